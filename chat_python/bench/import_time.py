@@ -0,0 +1,93 @@
+"""
+Measure how long a fresh interpreter takes to import a module, e.g. to check that
+`twitter_utils` stays cheap to import for new workers and test runs.
+
+    python bench/import_time.py --module twitter_utils --runs 10
+
+Prints a JSON report with the wall time of each run and the slowest imports of the
+last run, as reported by `python -X importtime`.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+chat_python_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+repo_dir = os.path.dirname(chat_python_dir)
+
+# twitter_utils refuses to import without its keys, the values don't matter here
+dummy_env = {
+    "game_api_for_twitter": "apt-bench",
+    "GROQ_API_KEY": "bench",
+    "ETHSCAN_API_KEY": "bench",
+    "BASESCAN_API_KEY": "bench",
+    "BASE_SEPOLIASCAN_API_KEY": "bench",
+    "INFURA_KEY": "bench",
+}
+
+
+def import_once(module: str, env: dict) -> tuple[float, str]:
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env,
+        cwd=chat_python_dir,
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{proc.stderr[-2000:]}")
+    return elapsed, proc.stderr
+
+
+def slowest_imports(importtime_log: str, top: int) -> list[dict]:
+    imports = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # "import time:   self [us] | cumulative | imported package"
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        imports.append({"module": name.strip(), "self_us": int(self_us), "cumulative_us": int(cumulative_us)})
+    return sorted(imports, key=lambda i: i["cumulative_us"], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the import time of a module.")
+    parser.add_argument("--module", default="twitter_utils")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+
+    env = {**dummy_env, **os.environ}
+    env["PYTHONPATH"] = os.pathsep.join([repo_dir, chat_python_dir, env.get("PYTHONPATH", "")])
+
+    times = []
+    log = ""
+    for _ in range(args.runs):
+        elapsed, log = import_once(args.module, env)
+        times.append(elapsed)
+
+    report = {
+        "module": args.module,
+        "runs": args.runs,
+        "wall_seconds": {
+            "min": min(times),
+            "median": statistics.median(times),
+            "max": max(times),
+        },
+        "slowest_imports": slowest_imports(log, args.top),
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Offline test of the payment indexer against the explorer stub from bench/stubs.py: indexes a
+range of blocks, restarts on the same database, and checks that indexing resumes from the
+checkpoint and that indexed payments can be looked up.
+
+    python bench/indexer_test.py    (or: python -m pytest bench/indexer_test.py)
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stubs import ExplorerStub, luna_wallet_address, usdc_address_basescan
+from payment_indexer import PaymentIndexer
+
+
+def test_indexer_resumes_from_checkpoint():
+    stub = ExplorerStub("fixed:0", usdc_address_basescan).start()
+    chain = {"name": "basescan", "rpc_url": stub.url, "usdc_address": usdc_address_basescan}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "payments.db")
+            first = stub.add_payment(block=stub.head - 50)
+            # not confirmed yet, so left for the next run
+            second = stub.add_payment(block=stub.head)
+
+            indexer = PaymentIndexer(path, [chain], luna_wallet_address, confirmations=2, max_block_range=40, start_lookback=100)
+            indexer.poll_chain(chain)
+            safe_head = stub.head - 2
+            assert indexer.checkpoint("basescan") == safe_head
+            assert stub.log_ranges[0][0] == safe_head - 99
+            assert indexer.lookup(first)["value"] == 15
+            assert indexer.lookup(first)["block_number"] == stub.head - 50
+            assert indexer.lookup(second) is None
+
+            # restart on the same database after the chain moved on
+            stub.head += 10
+            third = stub.add_payment(block=stub.head - 5)
+            stub.log_ranges.clear()
+            indexer = PaymentIndexer(path, [chain], luna_wallet_address, confirmations=2, max_block_range=40, start_lookback=100)
+            indexer.poll_chain(chain)
+            assert stub.log_ranges == [(safe_head + 1, stub.head - 2)]
+            assert indexer.checkpoint("basescan") == stub.head - 2
+            for tx_hash in (first, second, third):
+                payment = indexer.lookup(tx_hash)
+                assert payment["value"] == 15
+                assert payment["chain"] == "basescan"
+                assert payment["recipient"] == luna_wallet_address.lower()
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    test_indexer_resumes_from_checkpoint()
+    print("ok")
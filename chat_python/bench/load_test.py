@@ -0,0 +1,176 @@
+"""
+Offline load test of the chat API. Starts the stub GAME, Groq and explorer servers from
+bench/stubs.py, runs `chat_agent_fastapi:app` under uvicorn pointed at them, and drives many
+simulated partners concurrently, each sending its turns in order.
+
+    python bench/load_test.py --partners 200 --turns 5 --concurrency 50 --endpoint /get_chat_async
+
+Prints a JSON report with p50/p95/p99 latency, throughput, error count and the server's
+resident memory per session, so changes can be compared run to run without live services.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from stubs import start_stubs, stub_env
+
+chat_python_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+repo_dir = os.path.dirname(chat_python_dir)
+
+messages = [
+    "gm! I'm launching a token called $BENCH",
+    "it's for degens who like fast benchmarks",
+    "our edge is that it is very fast, check @bench",
+    "we're at the idea stage, I need an avatar and some memes",
+    "how much would that cost?",
+    "ok, sending the payment now",
+]
+
+
+def rss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def start_server(port: int, env: dict) -> subprocess.Popen:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "chat_agent_fastapi:app", "--port", str(port), "--log-level", "warning"],
+        cwd=chat_python_dir,
+        env=env,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Chat API exited with code {proc.returncode}")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/docs", timeout=1)
+            return proc
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("Chat API did not start within 60s")
+
+
+def run_partner(base_url: str, endpoint: str, partner: int, turns: int, timeout: float) -> list[tuple[float, bool]]:
+    """Send the partner's turns one after another, returning (latency, ok) per turn."""
+    session = requests.Session()
+    results = []
+    for turn in range(turns):
+        params = {
+            "partner_id": f"bench-{partner}",
+            "partner_name": f"Bench {partner}",
+            "message": messages[turn % len(messages)],
+        }
+        start = time.perf_counter()
+        try:
+            response = session.get(f"{base_url}{endpoint}", params=params, timeout=timeout)
+            # streamed replies count as done once the whole stream has arrived
+            ok = response.status_code == 200 and b"event: error" not in response.content
+        except requests.RequestException:
+            ok = False
+        results.append((time.perf_counter() - start, ok))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the chat API against stub services.")
+    parser.add_argument("--partners", type=int, default=100)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=50, help="partners chatting at the same time")
+    parser.add_argument("--endpoint", default="/get_chat_async",
+                        choices=["/get_chat", "/get_chat_async", "/get_chat_stream"])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--game-latency", default="lognormal:800:0.4",
+                        help="'fixed:MS', 'uniform:LOW_MS:HIGH_MS' or 'lognormal:MEDIAN_MS:SIGMA'")
+    parser.add_argument("--groq-latency", default="lognormal:600:0.5")
+    parser.add_argument("--explorer-latency", default="lognormal:250:0.3")
+    parser.add_argument("--function-call-rate", type=float, default=0.2)
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+
+    stubs = start_stubs(args.game_latency, args.groq_latency, args.explorer_latency, args.function_call_rate)
+    tmp_dir = tempfile.mkdtemp(prefix="chat-bench-")
+    env = {
+        **os.environ,
+        **stub_env(stubs),
+        "TX_CACHE_PATH": os.path.join(tmp_dir, "tx_cache.db"),
+        "SESSION_DB_PATH": os.path.join(tmp_dir, "sessions.db"),
+        "PAYMENT_INDEX_PATH": os.path.join(tmp_dir, "payments.db"),
+    }
+    env["PYTHONPATH"] = os.pathsep.join([repo_dir, chat_python_dir, env.get("PYTHONPATH", "")])
+
+    server = start_server(args.port, env)
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        rss_before = rss_kb(server.pid)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            futures = [
+                executor.submit(run_partner, base_url, args.endpoint, partner, args.turns, args.timeout)
+                for partner in range(args.partners)
+            ]
+            results = [r for future in futures for r in future.result()]
+        elapsed = time.perf_counter() - start
+        rss_after = rss_kb(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+        for stub in stubs.values():
+            stub.stop()
+
+    latencies = [latency for latency, ok in results if ok]
+    report = {
+        "endpoint": args.endpoint,
+        "partners": args.partners,
+        "turns": args.turns,
+        "concurrency": args.concurrency,
+        "latency_profile": {
+            "game": args.game_latency,
+            "groq": args.groq_latency,
+            "explorer": args.explorer_latency,
+            "function_call_rate": args.function_call_rate,
+        },
+        "requests": len(results),
+        "errors": len(results) - len(latencies),
+        "wall_seconds": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_seconds": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": statistics.fmean(latencies) if latencies else 0.0,
+        },
+        "memory": {
+            "rss_before_kb": rss_before,
+            "rss_after_kb": rss_after,
+            "kb_per_session": (rss_after - rss_before) / args.partners if args.partners else 0.0,
+        },
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+Local stand-ins for the external services the chat API depends on, for benchmarking without
+hitting live services:
+
+- GameStub: the GAME chat API used by `game_sdk`'s ChatAgent/Chat (conversation create/next/function result).
+- GroqStub: the OpenAI-compatible chat-completions endpoint used for requirement extraction.
+- ExplorerStub: the Etherscan/Basescan proxy API (GET) and the Infura JSON-RPC API (POST, incl. batches)
+  for one chain, including the eth_getLogs calls of the payment indexer.
+
+Each stub answers after a delay drawn from a configurable latency distribution. The stubs can be
+run on their own with `python bench/stubs.py`, or started in-process by bench/load_test.py.
+"""
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+luna_wallet_address = "0x140591903f35375AA78B01272882C2De3AeFE21c"
+usdc_address_ethscan = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
+usdc_address_basescan = "0x833589fCD6eDb6E08f4c7C32D4f71b54bdA02913"
+transfer_event_topic = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+
+class Latency:
+    """
+    Latency distribution, parsed from 'fixed:MS', 'uniform:LOW_MS:HIGH_MS' or
+    'lognormal:MEDIAN_MS:SIGMA'.
+    """
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        kind, *params = spec.split(":")
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self) -> float:
+        """A delay in seconds."""
+        if self.kind == "fixed":
+            ms = self.params[0]
+        elif self.kind == "uniform":
+            ms = random.uniform(self.params[0], self.params[1])
+        else:
+            median, sigma = self.params
+            ms = random.lognormvariate(0, sigma) * median
+        return ms / 1000
+
+    def wait(self):
+        time.sleep(self.sample())
+
+
+class StubServer:
+    """Runs a handler class on a background ThreadingHTTPServer."""
+
+    def __init__(self, latency: str, host: str = "127.0.0.1", port: int = 0):
+        self.latency = Latency(latency)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                stub.latency.wait()
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                self._reply(*stub.handle_get(url.path, query))
+
+            def do_POST(self):
+                stub.latency.wait()
+                length = int(self.headers.get("content-length", 0))
+                body = json.loads(self.rfile.read(length) or b"null")
+                self._reply(*stub.handle_post(urlparse(self.path).path, body))
+
+            def _reply(self, status: int, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle_get(self, path: str, query: dict):
+        return 404, {"error": "not found"}
+
+    def handle_post(self, path: str, body):
+        return 404, {"error": "not found"}
+
+
+class GameStub(StubServer):
+    """
+    GAME chat API. Replies with a canned message; with probability `function_call_rate` a turn
+    calls determine_price or check_payment instead, the latter with a hash from `new_payment`,
+    e.g. `ExplorerStub.add_payment`.
+    """
+
+    def __init__(self, latency: str, function_call_rate: float = 0.2, new_payment=None, **kwargs):
+        super().__init__(latency, **kwargs)
+        self.function_call_rate = function_call_rate
+        self.new_payment = new_payment or paid_transaction_hash
+
+    def handle_post(self, path: str, body):
+        parts = path.strip("/").split("/")
+        if parts == ["conversation"]:
+            return 200, {"data": {"conversation_id": str(uuid.uuid4())}}
+        if len(parts) == 3 and parts[0] == "conversation" and parts[2] == "next":
+            return 200, {"data": self._next_message(parts[1])}
+        if len(parts) == 4 and parts[0] == "conversation" and parts[2:] == ["function", "result"]:
+            return 200, {"data": {"chat_id": parts[1], "message": "Thanks, noted!", "is_finished": False}}
+        if len(parts) == 3 and parts[0] == "conversation" and parts[2] == "end":
+            return 200, {"data": {"chat_id": parts[1], "message": "Bye!", "is_finished": True}}
+        return 404, {"error": "not found"}
+
+    def _next_message(self, chat_id: str) -> dict:
+        message = {"chat_id": chat_id, "message": "gm! tell me more about your token.", "is_finished": False, "function_call": None}
+        if random.random() < self.function_call_rate:
+            if random.random() < 0.5:
+                message["function_call"] = {
+                    "id": str(uuid.uuid4()),
+                    "fn_name": "determine_price",
+                    "args": {"services": ["avatar design", "meme images"]},
+                }
+            else:
+                message["function_call"] = {
+                    "id": str(uuid.uuid4()),
+                    "fn_name": "check_payment",
+                    "args": {"transaction_hash": self.new_payment(), "price": 15},
+                }
+        return message
+
+
+class GroqStub(StubServer):
+    """OpenAI-compatible chat completions, always returning a complete set of requirements."""
+
+    requirements = {
+        "name": "BENCH",
+        "target": "degens",
+        "idea": "a benchmark token",
+        "edge": "it is very fast",
+        "references": ["@bench"],
+        "stage": "idea",
+        "services": ["avatar design", "meme images"],
+        "price": 15,
+        "paid": "false",
+    }
+
+    def handle_post(self, path: str, body):
+        if not path.endswith("/chat/completions"):
+            return 404, {"error": "not found"}
+        json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+        content = json.dumps(self.requirements) if json_mode else "The user wants a benchmark token."
+        prompt_tokens = sum(len(m["content"]) for m in body["messages"]) // 4
+        return 200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 60, "total_tokens": prompt_tokens + 60},
+        }
+
+
+def paid_transaction_hash() -> str:
+    """A random transaction hash that the explorer stubs report as a payment of 15 USDC."""
+    return "0x" + "be" + hashlib.sha256(uuid.uuid4().bytes).hexdigest()[2:]
+
+
+class ExplorerStub(StubServer):
+    """
+    One chain's explorer proxy API and JSON-RPC endpoint. Transactions whose hash starts with
+    0xbe are found if `has_payments` is set, as a fresh 15 USDC transfer into the Luna wallet;
+    every other hash is unknown. Payments added with `add_payment` are also returned by
+    eth_getLogs, in the block they were added at. `head` is the latest block and can be moved.
+    """
+
+    def __init__(self, latency: str, usdc_address: str, has_payments: bool = True, **kwargs):
+        super().__init__(latency, **kwargs)
+        self.usdc_address = usdc_address
+        self.has_payments = has_payments
+        self.head = 20_000_000
+        # tx_hash -> block number of the payments eth_getLogs knows about
+        self.payments = {}
+        # (fromBlock, toBlock) of every eth_getLogs call, to see where an indexer resumed
+        self.log_ranges = []
+        self._lock = threading.Lock()
+
+    def add_payment(self, block: int = None) -> str:
+        """A new paid transaction hash, mined at `block` (the head by default)."""
+        tx_hash = paid_transaction_hash()
+        with self._lock:
+            self.payments[tx_hash] = self.head if block is None else block
+        return tx_hash
+
+    def _found(self, tx_hash: str) -> bool:
+        return self.has_payments and tx_hash.lower().startswith("0xbe")
+
+    def _block(self, tx_hash: str) -> int:
+        with self._lock:
+            return self.payments.get(tx_hash.lower(), self.head)
+
+    def _transfer_log(self, tx_hash: str, block: int) -> dict:
+        return {
+            "address": self.usdc_address,
+            "topics": [
+                transfer_event_topic,
+                "0x" + "11" * 12 + "22" * 20,
+                "0x" + "00" * 12 + luna_wallet_address.lower()[2:],
+            ],
+            "data": "0x" + hex(15_000_000)[2:].rjust(64, "0"),
+            "blockNumber": hex(block),
+            "transactionHash": tx_hash,
+            "logIndex": "0x0",
+            "removed": False,
+        }
+
+    def _logs(self, query: dict) -> list:
+        from_block, to_block = int(query["fromBlock"], 16), int(query["toBlock"], 16)
+        with self._lock:
+            self.log_ranges.append((from_block, to_block))
+        if not self.has_payments or query.get("address", "").lower() != self.usdc_address.lower():
+            return []
+        with self._lock:
+            payments = sorted(self.payments.items(), key=lambda item: item[1])
+        return [self._transfer_log(tx_hash, block) for tx_hash, block in payments if from_block <= block <= to_block]
+
+    def _transaction(self, tx_hash: str):
+        if not self._found(tx_hash):
+            return None
+        wallet = luna_wallet_address.lower()[2:].rjust(64, "0")
+        amount = hex(15_000_000)[2:].rjust(64, "0")
+        return {
+            "hash": tx_hash,
+            "to": self.usdc_address,
+            "blockNumber": hex(self._block(tx_hash)),
+            # transfer(address,uint256)
+            "input": "0xa9059cbb" + wallet + amount,
+        }
+
+    def _receipt(self, tx_hash: str):
+        if not self._found(tx_hash):
+            return None
+        block = self._block(tx_hash)
+        return {
+            "transactionHash": tx_hash,
+            "status": "0x1",
+            "blockNumber": hex(block),
+            "logs": [self._transfer_log(tx_hash, block)],
+        }
+
+    def _call(self, method: str, params: list):
+        if method == "eth_getTransactionByHash":
+            return self._transaction(params[0])
+        if method == "eth_getTransactionReceipt":
+            return self._receipt(params[0])
+        if method == "eth_getBlockByNumber":
+            return {"number": params[0], "timestamp": hex(int(time.time()))}
+        if method == "eth_blockNumber":
+            return hex(self.head)
+        if method == "eth_getLogs":
+            return self._logs(params[0])
+        raise ValueError(f"Unsupported method {method}")
+
+    def handle_get(self, path: str, query: dict):
+        action = query.get("action")
+        if action in ("eth_getTransactionByHash", "eth_getTransactionReceipt"):
+            result = self._call(action, [query.get("txhash")])
+        elif action == "eth_getBlockByNumber":
+            result = self._call(action, [query.get("tag")])
+        else:
+            return 200, {"status": "0", "message": "NOTOK", "result": f"Unsupported action {action}"}
+        return 200, {"jsonrpc": "2.0", "id": 1, "result": result}
+
+    def handle_post(self, path: str, body):
+        def answer(call):
+            try:
+                return {"jsonrpc": "2.0", "id": call["id"], "result": self._call(call["method"], call.get("params", []))}
+            except ValueError as e:
+                return {"jsonrpc": "2.0", "id": call["id"], "error": {"code": -32601, "message": str(e)}}
+
+        if isinstance(body, list):
+            return 200, [answer(call) for call in body]
+        return 200, answer(body)
+
+
+def start_stubs(game_latency: str, groq_latency: str, explorer_latency: str, function_call_rate: float = 0.2) -> dict:
+    """Start all stubs on free ports and return them by name."""
+    # payments are made on Base, so every Ethereum lookup comes back empty like in production
+    basescan = ExplorerStub(explorer_latency, usdc_address_basescan).start()
+    return {
+        "game": GameStub(game_latency, function_call_rate=function_call_rate, new_payment=basescan.add_payment).start(),
+        "groq": GroqStub(groq_latency).start(),
+        "ethscan": ExplorerStub(explorer_latency, usdc_address_ethscan, has_payments=False).start(),
+        "basescan": basescan,
+    }
+
+
+def stub_env(stubs: dict) -> dict:
+    """Environment variables pointing the chat API at the stubs."""
+    return {
+        "game_api_for_twitter": "apt-bench",
+        "GROQ_API_KEY": "bench",
+        "ETHSCAN_API_KEY": "bench",
+        "BASESCAN_API_KEY": "bench",
+        "BASE_SEPOLIASCAN_API_KEY": "bench",
+        "INFURA_KEY": "bench",
+        "GAME_API_BASE_URL": stubs["game"].url,
+        "GROQ_BASE_URL": stubs["groq"].url,
+        "ETHSCAN_API_URL": f"{stubs['ethscan'].url}/api",
+        "BASESCAN_API_URL": f"{stubs['basescan'].url}/api",
+        "ETH_RPC_URL": stubs["ethscan"].url,
+        "BASE_RPC_URL": stubs["basescan"].url,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the stub servers until interrupted.")
+    parser.add_argument("--game-latency", default="lognormal:800:0.4")
+    parser.add_argument("--groq-latency", default="lognormal:600:0.5")
+    parser.add_argument("--explorer-latency", default="lognormal:250:0.3")
+    parser.add_argument("--function-call-rate", type=float, default=0.2)
+    args = parser.parse_args()
+
+    stubs = start_stubs(args.game_latency, args.groq_latency, args.explorer_latency, args.function_call_rate)
+    for name, value in stub_env(stubs).items():
+        print(f"export {name}={value}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        for stub in stubs.values():
+            stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,156 @@
-from fastapi import FastAPI
+import os
+import json
+import time
+import uuid
+import asyncio
+import threading
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import FastAPI, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from pydantic import BaseModel
 
 from game_sdk.game.chat_agent import Chat, ChatAgent
 import api
-from twitter_utils import determine_price_fn, check_payment_fn, twitter_chat_agent, parse_requiremnts
+from chat_history import ChatHistory
+from chat_pool import ChatPool, PrewarmedChatPool, chat_record, chat_from_record
+from extraction_queue import ExtractionQueue
+from idempotency import IdempotencyCache
+import metrics
+from metrics import log, stage_seconds
+from resilience import get_dependency, DependencyUnavailable, is_transient_request_error
+from llm_router import RouteRejected
+from session_store import create_session_store
+from twitter_utils import (
+    determine_price_fn,
+    check_payment_fn,
+    get_twitter_chat_agent,
+    parse_requiremnts,
+    summarize_conversation,
+    get_payment_indexer,
+    warm_up,
+    check_payments_batch,
+    payment_owner,
+    requirement_fields,
+    llm_requirement_fields,
+    requirements_from_text,
+    requirements_from_function_result,
+    needs_llm_extraction,
+)
 
 app = FastAPI()
 
-chat_details = {}
+action_space = [determine_price_fn, check_payment_fn]
+
+# conversation state per partner; only json-serializable data is stored, the Chat object
+# is rebuilt from its compact record so that sessions can live outside this process
+sessions = create_session_store()
+
+# 'incremental' sends only the turns since the last extraction along with the previous working
+# memory to the extraction model, 'full' sends the whole chat history every time
+extraction_mode = os.getenv("EXTRACTION_MODE", "incremental")
+# every n-th extraction run of a partner is redone from the full history so that drift in the
+# incrementally merged working memory doesn't accumulate; 0 disables this
+extraction_full_every = int(os.getenv("EXTRACTION_FULL_EVERY", 10))
+
+# number of most recent turns kept verbatim in a partner's chat history; older turns are folded
+# into a summary once CHAT_HISTORY_SUMMARIZE_EVERY turns have piled up beyond the window
+history_window = int(os.getenv("CHAT_HISTORY_WINDOW", 20))
+history_summarize_every = int(os.getenv("CHAT_HISTORY_SUMMARIZE_EVERY", 5))
+
+# responses of recent messages by idempotency key, so that retries aren't sent to the chat again
+responses = IdempotencyCache(
+    max_entries=int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", 10000)),
+    ttl=float(os.getenv("IDEMPOTENCY_TTL", 600)),
+)
+
+# one lock per partner so that messages from the same partner are handled in order,
+# while different partners run in parallel
+partner_locks = {}
+
+# the reply path and the extraction workers each update their own fields of a partner's session;
+# the read-modify-write of those updates is serialized per partner with these striped locks
+session_locks = [threading.Lock() for _ in range(64)]
+
+# chat turns of the async endpoints run on this pool; asyncio.to_thread's default executor only has
+# min(32, cpus + 4) threads, fewer than the pool the sync /get_chat runs its requests in
+chat_worker_threads = int(os.getenv("CHAT_WORKER_THREADS", 40))
+chat_executor = ThreadPoolExecutor(max_workers=chat_worker_threads, thread_name_prefix="chat")
+# size of the anyio thread pool the sync endpoints run in
+sync_worker_threads = 40
+
+# upper bound of the `concurrency` a /get_chat_batch request may ask for
+batch_max_concurrency = int(os.getenv("BATCH_MAX_CONCURRENCY", 16))
+
+# longest a /get_working_memory request waits for a new version before it returns the current one
+working_memory_max_wait = float(os.getenv("WORKING_MEMORY_MAX_WAIT", 30))
+# partner_id -> events of the requests waiting for the partner's next extraction
+working_memory_waiters = {}
+
+# chat.next isn't idempotent, so GAME calls aren't retried or hedged; the SDK takes no timeout,
+# so a call is given up on after GAME_TIMEOUT seconds while it finishes in the background. Its pool
+# has a thread for every thread a chat turn can run on, and as many again for calls given up on
+# that are still finishing, so that a burst of turns doesn't queue up and time out there
+game = get_dependency(
+    "game",
+    timeout=60,
+    retries=0,
+    enforce_timeout=True,
+    retry_on=is_transient_request_error,
+    max_workers=2 * (chat_worker_threads + sync_worker_threads),
+)
+
+# WARM_UP=0 skips creating the external clients at startup, e.g. for quick reloads in development
+warm_up_on_startup = os.getenv("WARM_UP", "1") == "1"
+# with PAYMENT_INDEXER=1 every process reads the shared payment index, but only one should follow
+# the chains, e.g. one worker of a cluster; PAYMENT_INDEXER_FOLLOW=0 only reads
+payment_indexer_follow = os.getenv("PAYMENT_INDEXER_FOLLOW", "1") == "1"
+
+@app.on_event("startup")
+def startup():
+    if warm_up_on_startup:
+        warm_up()
+    # the workers wake up long-polling requests on the event loop
+    loop = asyncio.get_running_loop()
+    extraction_queue.add_listener(lambda partner_id: loop.call_soon_threadsafe(wake_working_memory_waiters, partner_id))
+    extraction_queue.start()
+    if prewarmed_chats is not None:
+        prewarmed_chats.start()
+    payment_indexer = get_payment_indexer()
+    if payment_indexer is not None and payment_indexer_follow:
+        payment_indexer.start()
+
+@app.on_event("shutdown")
+def shutdown():
+    chat_executor.shutdown(wait=False)
+    extraction_queue.stop()
+    if prewarmed_chats is not None:
+        prewarmed_chats.stop()
+    payment_indexer = get_payment_indexer()
+    if payment_indexer is not None:
+        payment_indexer.stop()
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # a caller can pass its own trace ID to follow a message across services
+    trace_id = request.headers.get("x-trace-id") or metrics.new_trace_id()
+    metrics.trace_id.set(trace_id)
+    start = time.perf_counter()
+    response = await call_next(request)
+    # streamed responses are timed until their headers are sent
+    route = request.scope.get("route")
+    metrics.request_seconds.observe(time.perf_counter() - start, endpoint=route.path if route else "unmatched")
+    response.headers["x-trace-id"] = trace_id
+    return response
+
+@app.exception_handler(DependencyUnavailable)
+async def dependency_unavailable(request: Request, e: DependencyUnavailable):
+    return JSONResponse(status_code=503, content={"detail": str(e), "dependency": e.dependency})
 
 class userDetails(BaseModel):
     partner_id: str
@@ -17,56 +160,514 @@ class chatInput(BaseModel):
     partner_id: str
     partner_name: str
     message: str
+    # e.g. the tweet id; a retried message with the same key gets the original response
+    idempotency_key: Optional[str] = None
+    # working_memory_version of the partner's previous reply, for compact replies
+    working_memory_version: Optional[int] = None
 
-@app.get("/get_chat")
-def get_chat(partner_id: str, partner_name: str, message: str):
-    if partner_id not in chat_details:
-        chat = twitter_chat_agent.create_chat(
-            partner_id=partner_id, 
-            partner_name=partner_name, 
-            action_space=[determine_price_fn, check_payment_fn]
-        )
-        cur_chat_details = chat.__dict__
-        chat_details[partner_id] = cur_chat_details
-    else:
-        chat = Chat(conversation_id=chat_details[partner_id]["chat_id"], client=twitter_chat_agent.client)
+class paymentInput(BaseModel):
+    transaction_hash: str
+    price: float
+
+def session_lock(partner_id: str) -> threading.Lock:
+    return session_locks[hash(partner_id) % len(session_locks)]
+
+def update_session(partner_id: str, fields: dict) -> dict:
+    """Set the fields in the partner's session, keeping the others as they are now, and return the session."""
+    with session_lock(partner_id):
+        session = {**(sessions.get(partner_id) or {}), **fields}
+        sessions.set(partner_id, session)
+    return session
 
-        for key in chat.__dict__.keys():
-            chat.__setattr__(key, chat_details[partner_id][key])
-    
-    response = chat.next(message)
+def save_evicted_chat(partner_id: str, chat: Chat):
+    session = sessions.get(partner_id)
+    record = chat_record(chat)
+    if session is not None and any(session.get(key) != value for key, value in record.items()):
+        update_session(partner_id, record)
 
-    chat_history = [message, response.message]
-    if "chat_history" in chat_details[partner_id]:
-        chat_history = chat_details[partner_id]["chat_history"] + chat_history
-    
+# live Chat objects of recently active partners, so they aren't rebuilt on every message
+chat_pool = ChatPool(max_size=int(os.getenv("CHAT_POOL_SIZE", 1000)), on_evict=save_evicted_chat)
+
+# pre-creations go through their own dependency, so that failing background refills don't open
+# the circuit breaker of the GAME calls partners are waiting for; configured with GAME_PREWARM_*
+prewarm_game = get_dependency("game-prewarm", timeout=60, retries=0, enforce_timeout=True, retry_on=is_transient_request_error)
+
+def create_prewarmed_chat() -> Chat:
+    return prewarm_game.call(lambda timeout: get_twitter_chat_agent().create_chat(
+        partner_id=f"prewarmed-{uuid.uuid4().hex}",
+        partner_name=prewarm_partner_name,
+        action_space=action_space
+    ))
+
+# CHAT_PREWARM_SIZE chats are created ahead of time and handed to new partners, so their first
+# message doesn't wait for create_chat. GAME binds a conversation to the partner it was created
+# for, so these are created for a placeholder partner and the agent doesn't get the real
+# partner's id and name from the conversation; that's why this is off by default.
+prewarm_size = int(os.getenv("CHAT_PREWARM_SIZE", 0))
+prewarm_partner_name = os.getenv("CHAT_PREWARM_PARTNER_NAME", "friend")
+prewarmed_chats = PrewarmedChatPool(
+    create_prewarmed_chat,
+    size=prewarm_size,
+    max_age=float(os.getenv("CHAT_PREWARM_MAX_AGE", 600)),
+) if prewarm_size > 0 else None
+
+def get_partner_chat(partner_id: str, partner_name: str, session: dict) -> Chat:
+    chat = chat_pool.get(partner_id)
+    if session is None:
+        chat = prewarmed_chats.take() if prewarmed_chats is not None else None
+        if chat is None:
+            chat = game.call(lambda timeout: get_twitter_chat_agent().create_chat(
+                partner_id=partner_id,
+                partner_name=partner_name,
+                action_space=action_space
+            ))
+    elif chat is None or chat.chat_id != session["chat_id"]:
+        chat = chat_from_record(session, get_twitter_chat_agent().client, action_space)
+    chat_pool.put(partner_id, chat)
+    return chat
+
+def is_missing(value) -> bool:
+    return value is None or value in ("", "None", "null", [], {})
+
+def extract_working_memory(session: dict, history: ChatHistory, function_results: list = ()) -> dict:
+    """
+    Update the session's working memory and return the session fields to update.
+
+    `function_results` are the (fn_name, fn_info) of the function calls since the last extraction.
+
+    Fields that can be read from the function result or matched in the new messages are filled
+    locally. The extraction model is only called while one of the free-text fields is still
+    missing, when the new user messages say more than the local matching covers, or when a full
+    re-extraction is due. The path that produced each field is kept in `working_memory_sources`.
+    """
+    previous = session.get("working_memory")
+    sources = dict(session.get("working_memory_sources", {}))
+    llm_extractions = session.get("llm_extractions", 0)
+    # counts every run, whether or not it calls the model, so that full re-extractions stay on schedule
+    extraction_runs = session.get("extraction_runs", 0)
+    new_turns = history.since(session.get("extracted_upto", 0))
+
+    working_memory = dict(previous) if previous else {field: None for field in requirement_fields}
+    for field, value in requirements_from_text(new_turns).items():
+        if field in ("references", "services") and isinstance(working_memory.get(field), list):
+            value = list(dict.fromkeys(working_memory[field] + value))
+        working_memory[field] = value
+        sources[field] = "text_match"
+
+    full = (
+        extraction_mode == "full"
+        or previous is None
+        or (extraction_full_every > 0 and extraction_runs % extraction_full_every == 0)
+    )
+    extracted_upto = len(history)
+    extraction_runs += 1
+    if (
+        full
+        or any(is_missing(working_memory.get(field)) for field in llm_requirement_fields)
+        or needs_llm_extraction(new_turns)
+    ):
+        try:
+            if full:
+                extracted = parse_requiremnts(history.messages, summary=history.summary)
+            else:
+                # turns folded into the summary since the last extraction are only left in the summary
+                folded = session.get("extracted_upto", 0) < history.offset
+                extracted = parse_requiremnts(new_turns, working_memory, summary=history.summary if folded else None)
+        except (DependencyUnavailable, RouteRejected) as e:
+            # keep what was matched locally; the new turns are sent to the model again next time
+            log(f"Skipping requirement extraction: {e}")
+            extracted_upto = session.get("extracted_upto", 0)
+            # a full re-extraction that was due is tried again on the next run
+            extraction_runs -= 1
+        else:
+            for field in requirement_fields:
+                if not is_missing(extracted.get(field)):
+                    working_memory[field] = extracted[field]
+                    sources[field] = "llm"
+            llm_extractions += 1
+
+    # function results are exact, so they take precedence over anything the model returned
+    for fn_name, fn_info in function_results:
+        for field, value in requirements_from_function_result(fn_name, fn_info).items():
+            working_memory[field] = value
+            sources[field] = "function_result"
+
+    version = session.get("working_memory_version", 0)
+    if working_memory != previous:
+        version += 1
+
+    return {
+        "working_memory": working_memory,
+        "working_memory_version": version,
+        "working_memory_sources": sources,
+        "extracted_upto": extracted_upto,
+        "llm_extractions": llm_extractions,
+        "extraction_runs": extraction_runs,
+    }
+
+def run_chat(
+    partner_id: str,
+    partner_name: str,
+    message: str,
+    cursor: int = None,
+    compact: bool = False,
+    working_memory_version: int = None,
+) -> dict:
+    """
+    Send the partner's message to their chat and return the reply.
+
+    Args:
+        cursor (int): Turn index of the last turn the caller already has. If given, only the turns
+            after it are returned in `chat_history` instead of the whole retained history.
+        compact (bool): Leave out `working_memory` and `working_memory_sources` unless the stored
+            working memory is newer than the caller's `working_memory_version`.
+        working_memory_version (int): `working_memory_version` of the working memory the caller
+            already has, e.g. from its previous reply. Without it, compact replies include the
+            working memory too.
+
+    Requirement extraction runs in the background, so the returned working memory doesn't include
+    this turn yet if `working_memory_pending` is set; /get_working_memory returns it once it's done.
+    """
+    session, history, response = chat_turn(partner_id, partner_name, message)
     if response.function_call:
-        working_memory = parse_requiremnts(chat_history)
-    else:
-        working_memory = None
-
-    cur_chat_details = chat.__dict__
-    cur_chat_details["chat_history"] = chat_history
-    cur_chat_details["working_memory"] = working_memory
-    
-    chat_details[partner_id] = cur_chat_details
-    
+        queue_extraction(partner_id, response)
+
+    output = build_output(session, history, response, cursor, compact, working_memory_version)
+    output["working_memory_pending"] = extraction_queue.is_pending(partner_id)
+    return output
+
+def chat_turn(partner_id: str, partner_name: str, message: str):
+    """
+    Get the agent's reply to the message and save the turn to the chat history. The updated
+    session is returned along with the history and the reply.
+    """
+    session = sessions.get(partner_id)
+    chat = get_partner_chat(partner_id, partner_name, session)
+    if session is None:
+        session = chat_record(chat)
+
+    # a check_payment during the turn accepts a transaction hash only for the partner it first paid for
+    owner = payment_owner.set(partner_id)
+    try:
+        with stage_seconds.time(stage="chat_next"):
+            response = game.call(lambda timeout: chat.next(message))
+    finally:
+        payment_owner.reset(owner)
+
+    # the turn is appended to the history as it is now, since a background worker may have folded
+    # it in the meantime; the working memory is left as the extraction workers wrote it
+    with session_lock(partner_id):
+        session = sessions.get(partner_id) or session
+        history = ChatHistory.from_session(session, history_window, history_summarize_every)
+        history.append(message, response.message)
+        session = {**session, **chat_record(chat), **history.to_session()}
+        sessions.set(partner_id, session)
+
+    # summarizing old turns is a model call, so it's left to the extraction workers
+    if history.needs_summary():
+        extraction_queue.submit(partner_id)
+    return session, history, response
+
+def queue_extraction(partner_id: str, response):
+    """Queue a working memory extraction after a turn with a function call."""
+    extraction_queue.submit(partner_id, (response.function_call.fn_name, response.function_call.result.info))
+
+def fold_partner_history(partner_id: str):
+    """Fold the old turns of the partner's chat history into its summary, if enough have piled up."""
+    session = sessions.get(partner_id)
+    if session is None:
+        return
+    history = ChatHistory.from_session(session, history_window, history_summarize_every)
+    if not history.needs_summary():
+        return
+    offset = history.offset
+    history.fold(summarize_conversation)
+    folded = history.offset - offset
+
+    # turns added while summarizing are kept; only the folded ones are dropped
+    with session_lock(partner_id):
+        session = sessions.get(partner_id)
+        if session is None or session.get("history_offset", 0) != offset:
+            return
+        sessions.set(partner_id, {
+            **session,
+            "chat_history": session["chat_history"][folded:],
+            "history_offset": history.offset,
+            "history_summary": history.summary,
+        })
+
+def extract_partner_working_memory(partner_id: str, function_results: list):
+    """
+    Run by the extraction workers: fold old turns into the summary if due, then update the working
+    memory from the partner's latest chat history.
+    """
+    try:
+        fold_partner_history(partner_id)
+    except Exception as e:
+        # the turns stay in the window and folding is retried after the next turn
+        log(f"Failed to summarize chat history of {partner_id}: {e}")
+    session = sessions.get(partner_id)
+    if session is None:
+        return
+    history = ChatHistory.from_session(session, history_window, history_summarize_every)
+    update_session(partner_id, extract_working_memory(session, history, function_results))
+
+extraction_queue = ExtractionQueue(extract_partner_working_memory, workers=int(os.getenv("EXTRACTION_WORKERS", 4)))
+
+def wake_working_memory_waiters(partner_id: str):
+    for event in working_memory_waiters.pop(partner_id, []):
+        event.set()
+
+async def wait_for_working_memory(partner_id: str, after_version: Optional[int], timeout: float) -> dict:
+    """
+    The partner's session once its working memory version is past `after_version` (if given), no
+    extraction is pending any more, or `timeout` seconds have passed, whichever comes first.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        # registered before checking, so that an extraction finishing in between isn't missed
+        event = asyncio.Event()
+        working_memory_waiters.setdefault(partner_id, []).append(event)
+        try:
+            pending = extraction_queue.is_pending(partner_id)
+            session = await asyncio.to_thread(sessions.get, partner_id) or {}
+            remaining = deadline - time.monotonic()
+            newer = after_version is not None and session.get("working_memory_version", 0) > after_version
+            if newer or not pending or remaining <= 0:
+                return session
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        finally:
+            waiters = working_memory_waiters.get(partner_id, [])
+            if event in waiters:
+                waiters.remove(event)
+                if not waiters:
+                    del working_memory_waiters[partner_id]
+
+def build_output(
+    session: dict,
+    history: ChatHistory,
+    response,
+    cursor: int = None,
+    compact: bool = False,
+    known_version: int = None,
+) -> dict:
     output = {
-        "chat_id": chat_details[partner_id]["chat_id"],
-        "chat_history": chat_details[partner_id]["chat_history"],
-        "working_memory": chat_details[partner_id]["working_memory"],
+        "chat_id": session["chat_id"],
+        "turn_index": len(history) // 2,
         "message": response.message,
         "is_finished": response.is_finished,
+        "working_memory_version": session.get("working_memory_version", 0),
     }
-    
+
+    if cursor is None:
+        output["chat_history"] = list(history.messages)
+    else:
+        output["chat_history"] = history.since(2 * cursor)
+        # turns before the retained window were folded into the summary and can't be returned
+        output["history_truncated"] = 2 * cursor < history.offset
+
+    # extractions run between turns, so the caller's version is compared rather than the one this turn started with
+    if not compact or known_version is None or output["working_memory_version"] > known_version:
+        output["working_memory"] = session.get("working_memory")
+        output["working_memory_sources"] = session.get("working_memory_sources")
+
     if response.function_call:
-        function_call_deatails = {
-            "fn_name": response.function_call.fn_name,
-            "fn_args": response.function_call.fn_args,
-            "result_status": response.function_call.result.action_status,
-            "feedback_message": response.function_call.result.feedback_message,
-            "info": response.function_call.result.info
+        output = {**output, **function_call_details(response)}
+
+    return output
+
+def function_call_details(response) -> dict:
+    return {
+        "fn_name": response.function_call.fn_name,
+        "fn_args": response.function_call.fn_args,
+        "result_status": response.function_call.result.action_status,
+        "feedback_message": response.function_call.result.feedback_message,
+        "info": response.function_call.result.info
+    }
+
+async def run_in_chat_executor(fn, *args):
+    """Like asyncio.to_thread, but on `chat_executor`. The trace ID is carried over the same way."""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(chat_executor, functools.partial(context.run, fn, *args))
+
+@asynccontextmanager
+async def partner_lock(partner_id: str):
+    entry = partner_locks.setdefault(partner_id, {"lock": asyncio.Lock(), "users": 0})
+    entry["users"] += 1
+    try:
+        async with entry["lock"]:
+            yield
+    finally:
+        entry["users"] -= 1
+        if entry["users"] == 0:
+            del partner_locks[partner_id]
+
+def idempotency_cache_key(partner_id: str, idempotency_key: str) -> str:
+    return f"{partner_id}:{idempotency_key}"
+
+@app.get("/get_chat")
+def get_chat(
+    partner_id: str,
+    partner_name: str,
+    message: str,
+    cursor: Optional[int] = None,
+    compact: bool = False,
+    idempotency_key: Optional[str] = None,
+    working_memory_version: Optional[int] = None,
+):
+    if idempotency_key is None:
+        return run_chat(partner_id, partner_name, message, cursor, compact, working_memory_version)
+    return responses.run(
+        idempotency_cache_key(partner_id, idempotency_key),
+        lambda: run_chat(partner_id, partner_name, message, cursor, compact, working_memory_version),
+    )
+
+@app.get("/get_chat_async")
+async def get_chat_async(
+    partner_id: str,
+    partner_name: str,
+    message: str,
+    cursor: Optional[int] = None,
+    compact: bool = False,
+    idempotency_key: Optional[str] = None,
+    working_memory_version: Optional[int] = None,
+):
+    return await run_chat_async(partner_id, partner_name, message, cursor, compact, idempotency_key, working_memory_version)
+
+async def run_chat_async(
+    partner_id: str,
+    partner_name: str,
+    message: str,
+    cursor: int = None,
+    compact: bool = False,
+    idempotency_key: str = None,
+    working_memory_version: int = None,
+) -> dict:
+    async def run():
+        # chat.next (including the check_payment explorer lookups) is a blocking network call,
+        # so it runs in a worker thread instead of on the event loop
+        async with partner_lock(partner_id):
+            return await run_in_chat_executor(
+                run_chat, partner_id, partner_name, message, cursor, compact, working_memory_version
+            )
+
+    if idempotency_key is None:
+        return await run()
+    return await responses.run_async(idempotency_cache_key(partner_id, idempotency_key), run)
+
+@app.post("/get_chat_batch")
+async def get_chat_batch(items: list[chatInput], concurrency: int = 8, compact: bool = False):
+    """
+    Handle a page of messages, e.g. all new mentions, in one request. Different partners are
+    handled concurrently, at most `concurrency` messages at a time, while the messages of one
+    partner are handled one after another in input order.
+
+    Returns one result per item in input order: {"ok": true, "result": <the /get_chat response>}
+    or {"ok": false, "error": ...} if that item failed, without failing the rest.
+    """
+    semaphore = asyncio.Semaphore(max(1, min(concurrency, batch_max_concurrency)))
+    results = [None] * len(items)
+
+    async def run_item(i: int):
+        item = items[i]
+        # a slot is only held while a message is handled, so a partner with a long thread of
+        # messages doesn't keep other partners waiting between its messages
+        async with semaphore:
+            try:
+                output = await run_chat_async(
+                    item.partner_id,
+                    item.partner_name,
+                    item.message,
+                    compact=compact,
+                    idempotency_key=item.idempotency_key,
+                    working_memory_version=item.working_memory_version,
+                )
+                results[i] = {"ok": True, "result": output}
+            except Exception as e:
+                log(f"Batch item {i} of {item.partner_id} failed: {e}")
+                results[i] = {"ok": False, "error": str(e)}
+
+    async def run_partner(indices: list[int]):
+        for i in indices:
+            await run_item(i)
+
+    by_partner = {}
+    for i, item in enumerate(items):
+        by_partner.setdefault(item.partner_id, []).append(i)
+    await asyncio.gather(*(run_partner(indices) for indices in by_partner.values()))
+    return results
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+@app.get("/get_chat_stream")
+async def get_chat_stream(partner_id: str, partner_name: str, message: str):
+    """
+    Streaming variant of /get_chat using Server-Sent Events. The agent's reply is sent as a
+    'reply' event as soon as it exists, followed by a 'function_call' event with the function
+    result and a 'working_memory' event once the background requirement extraction is done, then 'done'.
+    """
+    async def events():
+        try:
+            async with partner_lock(partner_id):
+                session, history, response = await run_in_chat_executor(chat_turn, partner_id, partner_name, message)
+                if response.function_call:
+                    queue_extraction(partner_id, response)
+            yield sse_event("reply", {
+                "chat_id": session["chat_id"],
+                "turn_index": len(history) // 2,
+                "message": response.message,
+                "is_finished": response.is_finished,
+            })
+
+            if response.function_call:
+                yield sse_event("function_call", function_call_details(response))
+                session = await wait_for_working_memory(partner_id, None, working_memory_max_wait)
+                yield sse_event("working_memory", working_memory_details(partner_id, session))
+        except Exception as e:
+            log(f"Error streaming chat for {partner_id}: {e}")
+            yield sse_event("error", {"detail": str(e)})
+        yield sse_event("done", {})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def working_memory_details(partner_id: str, session: dict) -> dict:
+    return {
+        "working_memory": session.get("working_memory"),
+        "working_memory_sources": session.get("working_memory_sources"),
+        "working_memory_version": session.get("working_memory_version", 0),
+        "working_memory_pending": extraction_queue.is_pending(partner_id),
+    }
+
+@app.get("/get_working_memory")
+async def get_working_memory(partner_id: str, after_version: Optional[int] = None, wait: float = 0):
+    """
+    The partner's latest extracted requirements. With `after_version` and `wait`, this is a long
+    poll: it waits up to `wait` seconds for a version newer than `after_version` to be extracted,
+    and returns early once no extraction is pending for the partner.
+    """
+    session = await wait_for_working_memory(partner_id, after_version, min(wait, working_memory_max_wait))
+    return working_memory_details(partner_id, session)
+
+@app.post("/check_payments")
+async def check_payments(payments: list[paymentInput]):
+    results = await asyncio.to_thread(
+        check_payments_batch,
+        [(payment.transaction_hash, payment.price) for payment in payments],
+    )
+    return [
+        {
+            "transaction_hash": payment.transaction_hash,
+            "result_status": result_status,
+            "feedback_message": feedback_message,
+            "info": info,
         }
-        output = {**output, **function_call_deatails}
-    
-    return output
\ No newline at end of file
+        for payment, (result_status, feedback_message, info) in zip(payments, results)
+    ]
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,67 @@
+from typing import Callable
+
+
+class ChatHistory:
+    """
+    Alternating user and agent messages of a conversation, keeping only a bounded window of the
+    most recent turns. Older turns are folded into a compact text summary.
+
+    `messages` holds the retained messages, starting at message number `offset` of the conversation;
+    `summary` covers everything before that. New turns are appended in place. Once more than
+    `window + summarize_every` turns are retained, the oldest ones are folded into the summary
+    until only `window` turns are left, so the summarizer runs once every `summarize_every` turns.
+    """
+
+    def __init__(self, window: int = 20, summarize_every: int = 5, messages: list[str] = None, offset: int = 0, summary: str = ""):
+        self.window = window
+        self.summarize_every = summarize_every
+        self.messages = messages if messages is not None else []
+        self.offset = offset
+        self.summary = summary
+
+    @classmethod
+    def from_session(cls, session: dict, window: int = 20, summarize_every: int = 5) -> "ChatHistory":
+        return cls(
+            window=window,
+            summarize_every=summarize_every,
+            # copied, so that appending doesn't change the stored session or replies already returned
+            messages=list(session.get("chat_history", [])),
+            offset=session.get("history_offset", 0),
+            summary=session.get("history_summary", ""),
+        )
+
+    def to_session(self) -> dict:
+        return {
+            "chat_history": self.messages,
+            "history_offset": self.offset,
+            "history_summary": self.summary,
+        }
+
+    def __len__(self) -> int:
+        """Number of messages in the whole conversation, including the summarized ones."""
+        return self.offset + len(self.messages)
+
+    def append(self, user_message: str, agent_message: str):
+        self.messages.append(user_message)
+        self.messages.append(agent_message)
+
+    def since(self, index: int) -> list[str]:
+        """Retained messages from message number `index` of the conversation on."""
+        return self.messages[max(index - self.offset, 0):]
+
+    def needs_summary(self) -> bool:
+        return len(self.messages) > 2 * (self.window + self.summarize_every)
+
+    def fold(self, summarize: Callable[[str, list[str]], str]):
+        """
+        Fold the turns outside of the window into the summary.
+
+        Args:
+            summarize: Called with the current summary and the messages to fold in, returns the new summary.
+        """
+        n = len(self.messages) - 2 * self.window
+        if n <= 0:
+            return
+        self.summary = summarize(self.summary, self.messages[:n])
+        self.messages = self.messages[n:]
+        self.offset += n
@@ -0,0 +1,169 @@
+import time
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Optional
+
+from game_sdk.game.chat_agent import Chat
+from game_sdk.game.custom_types import Function
+
+from metrics import log, prewarmed_chats, prewarmed_chats_ready, prewarm_refill_seconds
+
+
+def chat_record(chat: Chat) -> dict:
+    """
+    Compact, JSON-serializable record of a chat: its id and the names of its functions.
+    The client and function objects are not stored and get re-attached by `chat_from_record`.
+    """
+    return {
+        "chat_id": chat.chat_id,
+        "actions": list(chat.action_space.keys()) if chat.action_space else [],
+    }
+
+
+def chat_from_record(record: dict, client, functions: list[Function]) -> Chat:
+    actions = record.get("actions")
+    if actions is None:
+        action_space = functions
+    else:
+        action_space = [fn for fn in functions if fn.fn_name in actions]
+    return Chat(conversation_id=record["chat_id"], client=client, action_space=action_space)
+
+
+class ChatPool:
+    """
+    Bounded pool of live `Chat` objects keyed by partner id.
+
+    Once more than `max_size` chats are held, the least recently used one is evicted and
+    handed to `on_evict(partner_id, chat)`, which can persist it with `chat_record`.
+    """
+
+    def __init__(self, max_size: int = 1000, on_evict: Optional[Callable[[str, Chat], None]] = None):
+        self.max_size = max_size
+        self.on_evict = on_evict
+        self._chats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, partner_id: str) -> Optional[Chat]:
+        with self._lock:
+            chat = self._chats.get(partner_id)
+            if chat is not None:
+                self._chats.move_to_end(partner_id)
+            return chat
+
+    def put(self, partner_id: str, chat: Chat):
+        evicted = []
+        with self._lock:
+            self._chats[partner_id] = chat
+            self._chats.move_to_end(partner_id)
+            while len(self._chats) > self.max_size:
+                evicted.append(self._chats.popitem(last=False))
+
+        if self.on_evict:
+            for evicted_id, evicted_chat in evicted:
+                self.on_evict(evicted_id, evicted_chat)
+
+    def discard(self, partner_id: str):
+        with self._lock:
+            self._chats.pop(partner_id, None)
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+
+class PrewarmedChatPool:
+    """
+    Chats created ahead of time, so that a new partner's first message doesn't wait for the
+    `create_chat` round trip. A background thread keeps `size` chats ready, refilling the pool
+    whenever one is taken.
+
+    Chats are handed out oldest first. A chat that has waited longer than `max_age` seconds is
+    dropped and ended by the background thread instead, as an unused conversation can't be
+    relied on to stay open.
+
+    Args:
+        create (Callable[[], Chat]): Creates a new chat.
+    """
+
+    def __init__(self, create: Callable[[], Chat], size: int = 5, max_age: float = 600, retry_interval: float = 5):
+        self.create = create
+        self.size = size
+        self.max_age = max_age
+        self.retry_interval = retry_interval
+        # (created_at, chat), oldest first
+        self._chats = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def take(self) -> Optional[Chat]:
+        """
+        A pre-created chat, or None if none is ready. Expired chats are skipped and left for the
+        refill thread to end, so that the caller doesn't wait for it.
+        """
+        chat = None
+        with self._lock:
+            now = time.monotonic()
+            for i, (created_at, candidate) in enumerate(self._chats):
+                if now - created_at < self.max_age:
+                    chat = candidate
+                    del self._chats[i]
+                    break
+            prewarmed_chats_ready.set(sum(now - created_at < self.max_age for created_at, _ in self._chats))
+        prewarmed_chats.inc(result="miss" if chat is None else "hit")
+        self._wake.set()
+        return chat
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="chat-prewarm", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _end(self, chats: list[Chat]):
+        for chat in chats:
+            prewarmed_chats.inc(result="expired")
+            try:
+                chat.end()
+            except Exception as e:
+                log(f"Failed to end expired chat {chat.chat_id}: {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            with self._lock:
+                now = time.monotonic()
+                expired = [chat for created_at, chat in self._chats if now - created_at >= self.max_age]
+                self._chats = deque((created_at, chat) for created_at, chat in self._chats if now - created_at < self.max_age)
+                missing = self.size - len(self._chats)
+                prewarmed_chats_ready.set(len(self._chats))
+            self._end(expired)
+
+            failed = False
+            for _ in range(missing):
+                if self._stop.is_set():
+                    return
+                start = time.perf_counter()
+                try:
+                    chat = self.create()
+                except Exception as e:
+                    log(f"Failed to pre-create a chat: {e}")
+                    failed = True
+                    break
+                prewarm_refill_seconds.observe(time.perf_counter() - start)
+                with self._lock:
+                    self._chats.append((time.monotonic(), chat))
+                    prewarmed_chats_ready.set(len(self._chats))
+
+            # wake up for the next take, the next expiry, or to retry a failed refill
+            with self._lock:
+                next_expiry = self._chats[0][0] + self.max_age - time.monotonic() if self._chats else self.max_age
+            self._wake.wait(min(next_expiry, self.retry_interval) if failed else max(next_expiry, 0))
@@ -0,0 +1,244 @@
+"""
+Multi-process deployment of the chat API.
+
+Starts N uvicorn workers running `chat_agent_fastapi:app` on consecutive ports, all sharing
+conversation state through one SQLite session store, and a router in front of them that
+sends every partner to the same worker via a consistent hash of `partner_id`. That keeps
+each worker's session cache and per-partner lock hot, while throughput scales with cores.
+
+    python cluster.py --workers 4 --port 8000
+
+To route across replicas started elsewhere, set CLUSTER_WORKERS to a comma-separated
+list of worker base URLs and pass `--workers 0`. Set CLUSTER_WORKER_COUNT on those replicas to
+the total number of workers, so that they split the explorer and Infura rate limits, and
+PAYMENT_INDEXER_FOLLOW=0 on all but one of them.
+"""
+import os
+import sys
+import json
+import uuid
+import bisect
+import asyncio
+import hashlib
+import argparse
+import subprocess
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from starlette.background import BackgroundTask
+
+
+class HashRing:
+    """
+    Consistent hash ring. Each node is placed on the ring `replicas` times, so removing
+    or adding a node only moves the partners that hashed to that node.
+    """
+
+    def __init__(self, nodes: list[str], replicas: int = 100):
+        self.replicas = replicas
+        self._keys = []
+        self._nodes = {}
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def add(self, node: str):
+        for i in range(self.replicas):
+            h = self._hash(f"{node}#{i}")
+            self._nodes[h] = node
+            bisect.insort(self._keys, h)
+
+    def remove(self, node: str):
+        for i in range(self.replicas):
+            h = self._hash(f"{node}#{i}")
+            del self._nodes[h]
+            self._keys.remove(h)
+
+    def nodes(self) -> list[str]:
+        return sorted(set(self._nodes.values()))
+
+    def get(self, key: str) -> str:
+        if not self._keys:
+            raise ValueError("Hash ring is empty")
+        idx = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._nodes[self._keys[idx]]
+
+
+router_app = FastAPI()
+ring = HashRing([])
+http_client = None
+
+
+@router_app.on_event("startup")
+async def startup():
+    global http_client
+    for url in os.getenv("CLUSTER_WORKERS", "").split(","):
+        if url:
+            ring.add(url)
+    http_client = httpx.AsyncClient(
+        timeout=None,
+        limits=httpx.Limits(max_connections=1000, max_keepalive_connections=100),
+    )
+
+
+@router_app.on_event("shutdown")
+async def shutdown():
+    await http_client.aclose()
+
+
+def forward_headers(request: Request, trace_id: str = None) -> dict:
+    headers = {"content-type": request.headers.get("content-type", "application/json")}
+    trace_id = trace_id or request.headers.get("x-trace-id")
+    if trace_id:
+        headers["x-trace-id"] = trace_id
+    return headers
+
+
+def merge_metrics(texts: dict[str, str]) -> str:
+    """
+    Merge the /metrics output of the workers into one exposition, with a `worker` label on every
+    sample. Samples of a metric stay grouped under its HELP and TYPE lines, as the format requires.
+    """
+    families = {}
+    for worker, text in texts.items():
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                family = families.setdefault(line.split()[2], {"meta": [], "samples": []})
+                if line not in family["meta"]:
+                    family["meta"].append(line)
+            elif line and family is not None:
+                series, value = line.rsplit(" ", 1)
+                label = f'worker="{worker}"'
+                series = series[:-1] + f",{label}}}" if series.endswith("}") else series + f"{{{label}}}"
+                family["samples"].append(f"{series} {value}")
+    return "\n".join(line for family in families.values() for line in family["meta"] + family["samples"]) + "\n"
+
+
+@router_app.get("/metrics")
+async def route_metrics():
+    """The metrics of all workers, labeled by worker."""
+    workers = ring.nodes()
+
+    async def fetch(worker: str) -> str:
+        try:
+            response = await http_client.get(f"{worker}/metrics")
+            response.raise_for_status()
+            return response.text
+        except httpx.HTTPError:
+            # a worker that's down is left out rather than failing the whole scrape
+            return ""
+
+    texts = await asyncio.gather(*(fetch(worker) for worker in workers))
+    return PlainTextResponse(merge_metrics(dict(zip(workers, texts))), media_type="text/plain; version=0.0.4")
+
+
+@router_app.post("/get_chat_batch")
+async def route_chat_batch(request: Request):
+    """
+    A batch holds messages of many partners, so it's split by the worker each partner belongs to.
+    The parts are sent to their workers concurrently, each with the batch's `concurrency`, and
+    the results are put back in input order.
+    """
+    # the parts share one trace ID, so that the batch can be followed across workers
+    trace_id = request.headers.get("x-trace-id") or uuid.uuid4().hex[:16]
+    try:
+        items = json.loads(await request.body())
+        by_worker = {}
+        for i, item in enumerate(items):
+            by_worker.setdefault(ring.get(item["partner_id"]), []).append(i)
+    except (ValueError, TypeError, KeyError):
+        # not a list of messages; a worker answers with the usual validation error
+        return await route("get_chat_batch", request)
+
+    async def send(worker: str, indices: list[int]) -> list[dict]:
+        try:
+            response = await http_client.post(
+                f"{worker}/get_chat_batch",
+                params=request.query_params,
+                json=[items[i] for i in indices],
+                headers=forward_headers(request, trace_id),
+            )
+        except httpx.HTTPError as e:
+            return [{"ok": False, "error": f"{worker} unreachable: {e}"}] * len(indices)
+        if response.status_code != 200:
+            return [{"ok": False, "error": f"{worker} responded {response.status_code}: {response.text}"}] * len(indices)
+        return response.json()
+
+    results = [None] * len(items)
+    parts = await asyncio.gather(*(send(worker, indices) for worker, indices in by_worker.items()))
+    for indices, part in zip(by_worker.values(), parts):
+        for i, result in zip(indices, part):
+            results[i] = result
+    return JSONResponse(results, headers={"x-trace-id": trace_id})
+
+
+@router_app.api_route("/{path:path}", methods=["GET", "POST"])
+async def route(path: str, request: Request):
+    partner_id = request.query_params.get("partner_id", "")
+    worker = ring.get(partner_id)
+    upstream = http_client.build_request(
+        request.method,
+        f"{worker}/{path}",
+        params=request.query_params,
+        content=await request.body(),
+        headers=forward_headers(request),
+    )
+    # the response is passed on as it arrives, so that /get_chat_stream events aren't held back
+    response = await http_client.send(upstream, stream=True)
+    return StreamingResponse(
+        response.aiter_bytes(),
+        status_code=response.status_code,
+        media_type=response.headers.get("content-type"),
+        headers={"x-trace-id": response.headers["x-trace-id"]} if "x-trace-id" in response.headers else None,
+        background=BackgroundTask(response.aclose),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the chat API as a multi-process cluster.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    # every worker has to see the same conversations, so state lives in a shared sqlite file
+    env = dict(os.environ)
+    env.setdefault("SESSION_STORE", "sqlite")
+    env.setdefault("SESSION_DB_PATH", os.path.abspath("sessions.db"))
+    env["SESSION_CACHE_VALIDATE"] = "1"
+
+    workers = [url for url in os.getenv("CLUSTER_WORKERS", "").split(",") if url]
+    # rate limits are split between the workers, and only the first one follows the chains
+    # for the payment index
+    env.setdefault("CLUSTER_WORKER_COUNT", str(len(workers) + args.workers))
+    procs = []
+    for i in range(args.workers):
+        port = args.port + 1 + i
+        worker_env = dict(env)
+        if i > 0:
+            worker_env["PAYMENT_INDEXER_FOLLOW"] = "0"
+        procs.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "chat_agent_fastapi:app", "--host", "127.0.0.1", "--port", str(port)],
+            env=worker_env,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ))
+        workers.append(f"http://127.0.0.1:{port}")
+    os.environ["CLUSTER_WORKERS"] = ",".join(workers)
+
+    try:
+        uvicorn.run(router_app, host=args.host, port=args.port)
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import queue
+import threading
+import contextvars
+from typing import Callable
+
+from metrics import log, extraction_queue_depth, extractions_coalesced
+
+
+class ExtractionQueue:
+    """
+    Runs working memory extractions on background threads, so that replies don't wait for the
+    extraction model.
+
+    Extractions requested for a partner while one is already queued or running are coalesced:
+    the next run for the partner gets the function results of all of them, and reads the chat
+    history as it is then. At most one extraction runs per partner at a time.
+
+    Args:
+        extract (Callable): Called on a worker thread with a partner id and the list of
+            (fn_name, fn_info) function results submitted since the partner's last run.
+        workers (int): Number of worker threads.
+    """
+
+    def __init__(self, extract: Callable[[str, list], None], workers: int = 4):
+        self.extract = extract
+        self.workers = workers
+        self._queue = queue.Queue()
+        # partner_id -> (context of the latest submit, function results) waiting for the next run
+        self._pending = {}
+        self._running = set()
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def add_listener(self, listener: Callable[[str], None]):
+        """Call `listener(partner_id)` on the worker thread after each extraction."""
+        self._listeners.append(listener)
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"extraction-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, partner_id: str, function_result: tuple = None):
+        """Queue an extraction for the partner, with the (fn_name, fn_info) of the turn's function call."""
+        # the extraction runs in the context of the request that queued it last, to keep its trace ID
+        context = contextvars.copy_context()
+        with self._lock:
+            if partner_id in self._pending:
+                extractions_coalesced.inc()
+                _, function_results = self._pending[partner_id]
+            else:
+                function_results = []
+                if partner_id not in self._running:
+                    self._queue.put(partner_id)
+            if function_result is not None:
+                function_results.append(function_result)
+            self._pending[partner_id] = (context, function_results)
+            extraction_queue_depth.set(len(self._pending))
+
+    def is_pending(self, partner_id: str) -> bool:
+        """Whether an extraction for the partner is queued or running."""
+        with self._lock:
+            return partner_id in self._pending or partner_id in self._running
+
+    def _run(self):
+        while True:
+            partner_id = self._queue.get()
+            if partner_id is None:
+                return
+            with self._lock:
+                context, function_results = self._pending.pop(partner_id)
+                self._running.add(partner_id)
+                extraction_queue_depth.set(len(self._pending))
+            try:
+                context.run(self.extract, partner_id, function_results)
+            except Exception as e:
+                context.run(log, f"Working memory extraction of {partner_id} failed: {e}")
+            finally:
+                with self._lock:
+                    self._running.discard(partner_id)
+                    # requested while this one was running
+                    if partner_id in self._pending:
+                        self._queue.put(partner_id)
+            for listener in self._listeners:
+                listener(partner_id)
@@ -0,0 +1,93 @@
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Awaitable, Callable
+
+
+class IdempotencyCache:
+    """
+    Remembers the result of each request by its idempotency key, so that a retried request gets
+    the original response instead of being processed again.
+
+    A request that is still in flight is coalesced too: duplicates wait for the original and
+    share its result. Completed results are kept for `ttl` seconds, and at most `max_entries`
+    of them are kept. Failed requests aren't cached, so that a retry runs them again.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (future, expires_at); expires_at is None while the request is in flight
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _begin(self, key: str) -> tuple[Future, bool]:
+        """Returns the future holding the key's result, and whether the caller has to compute it."""
+        with self._lock:
+            now = time.monotonic()
+            entry = self._entries.get(key)
+            if entry is not None:
+                future, expires_at = entry
+                if expires_at is None or expires_at > now:
+                    return future, False
+
+            future = Future()
+            self._entries[key] = (future, None)
+            self._entries.move_to_end(key)
+            self._evict(now)
+            return future, True
+
+    def _finish(self, key: str, future: Future, result=None, error: BaseException = None):
+        with self._lock:
+            if error is None:
+                self._entries[key] = (future, time.monotonic() + self.ttl)
+            elif self._entries.get(key, (None,))[0] is future:
+                del self._entries[key]
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def _evict(self, now: float):
+        if len(self._entries) > self.max_entries:
+            for key in list(self._entries):
+                if len(self._entries) <= self.max_entries:
+                    break
+                if self._entries[key][1] is not None:
+                    del self._entries[key]
+
+        # entries are ordered by start time, so expired results are found at the front
+        for key, (_, expires_at) in list(self._entries.items()):
+            if expires_at is None:
+                continue
+            if expires_at > now:
+                break
+            del self._entries[key]
+
+    def run(self, key: str, fn: Callable):
+        """Return the cached or in-flight result for the key, or compute it with `fn()`."""
+        future, owner = self._begin(key)
+        if not owner:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    async def run_async(self, key: str, fn: Callable[[], Awaitable]):
+        """Async version of `run`, where `fn()` returns an awaitable."""
+        future, owner = self._begin(key)
+        if not owner:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
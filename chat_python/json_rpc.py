@@ -0,0 +1,71 @@
+import itertools
+
+import requests
+
+from rate_limiter import RateLimited, retry_after_seconds
+
+# error code providers like Infura use for requests over the rate limit
+rate_limit_error_code = -32005
+
+
+class JsonRpcError(Exception):
+    pass
+
+
+def raise_for_rate_limit(response: requests.Response, errors: list):
+    if response.status_code == 429 or any(
+        isinstance(error, dict) and error.get("code") == rate_limit_error_code for error in errors
+    ):
+        raise RateLimited(f"Rate limited by {response.url}", retry_after_seconds(response))
+
+
+_ids = itertools.count(1)
+
+
+def rpc_call(session: requests.Session, url: str, method: str, params: list, timeout: float = 10):
+    """Make a single Ethereum JSON-RPC call and return its result."""
+    payload = {"jsonrpc": "2.0", "id": next(_ids), "method": method, "params": params}
+    response = session.post(url, json=payload, timeout=timeout)
+    raise_for_rate_limit(response, [])
+    response.raise_for_status()
+    data = response.json()
+    raise_for_rate_limit(response, [data.get("error")])
+    if "error" in data:
+        raise JsonRpcError(f"{method} failed: {data['error']}")
+    return data["result"]
+
+
+def rpc_batch(session: requests.Session, url: str, calls: list[tuple[str, list]], timeout: float = 10) -> list:
+    """
+    Send several JSON-RPC calls in one batch request. Returns the results in the order of
+    `calls`; a call that failed is returned as a `JsonRpcError` instead of raising.
+    """
+    if not calls:
+        return []
+
+    ids = [next(_ids) for _ in calls]
+    payload = [
+        {"jsonrpc": "2.0", "id": call_id, "method": method, "params": params}
+        for call_id, (method, params) in zip(ids, calls)
+    ]
+    response = session.post(url, json=payload, timeout=timeout)
+    raise_for_rate_limit(response, [])
+    response.raise_for_status()
+    data = response.json()
+    # a throttled call fails the whole batch, so that it's retried as one after backing off
+    raise_for_rate_limit(response, [data.get("error")] if isinstance(data, dict) else [item.get("error") for item in data])
+    if isinstance(data, dict):
+        # some providers answer a rejected batch with a single error object
+        raise JsonRpcError(f"Batch request failed: {data.get('error')}")
+
+    by_id = {item.get("id"): item for item in data}
+    results = []
+    for call_id, (method, _) in zip(ids, calls):
+        item = by_id.get(call_id)
+        if item is None:
+            results.append(JsonRpcError(f"{method} missing from batch response"))
+        elif "error" in item:
+            results.append(JsonRpcError(f"{method} failed: {item['error']}"))
+        else:
+            results.append(item["result"])
+    return results
@@ -0,0 +1,196 @@
+"""
+Routing of LLM calls across models of different size: a call goes to the smallest model first,
+and its answer is only used if it passes validation; otherwise the call escalates to the next,
+larger model. Each model has its own concurrency limit, and the recent success rate and latency
+of every model decide whether it's worth trying within a call's latency budget.
+
+Models are configured as a comma-separated list of `model` or `model:max_concurrency`,
+smallest first, e.g. "llama-3.1-8b-instant:16,llama-3.3-70b-versatile:4". The concurrency is
+split between the processes sharing it.
+"""
+import time
+import threading
+from collections import deque
+from typing import Callable, Optional, Tuple
+
+from resilience import DependencyUnavailable
+from metrics import log, llm_route_calls, llm_route_seconds, record_llm_usage
+
+
+class RouteRejected(Exception):
+    """No model produced an answer that passed validation."""
+
+
+class ModelRoute:
+    """
+    One model of a router: its concurrency limit and a window of recent outcomes.
+
+    Args:
+        max_concurrency (int): Max calls to the model in flight at once.
+        window (int): Number of recent calls the success rate and latency are computed from.
+    """
+
+    def __init__(self, model: str, max_concurrency: int = 8, window: int = 100):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        # (accepted, seconds) of the most recent calls
+        self._outcomes = deque(maxlen=window)
+        self._calls = 0
+        self._lock = threading.Lock()
+
+    def record(self, accepted: bool, seconds: float):
+        with self._lock:
+            self._outcomes.append((accepted, seconds))
+
+    def next_call(self) -> int:
+        """Number of the call about to be made, counting from 0."""
+        with self._lock:
+            self._calls += 1
+            return self._calls - 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            outcomes = list(self._outcomes)
+        latencies = sorted(seconds for _, seconds in outcomes)
+        return {
+            "samples": len(outcomes),
+            "success_rate": sum(accepted for accepted, _ in outcomes) / len(outcomes) if outcomes else None,
+            "p50_seconds": latencies[len(latencies) // 2] if latencies else None,
+            "p90_seconds": latencies[min(int(len(latencies) * 0.9), len(latencies) - 1)] if latencies else None,
+        }
+
+
+class LLMRouter:
+    """
+    Calls `complete(model, messages, **kwargs)` with each model in turn, smallest first, until
+    the `validate` function given to `route` accepts the answer.
+
+    `validate(content)` returns `(value, problem)`: `problem` is None if the answer can be used,
+    and otherwise names what's wrong with it, e.g. "invalid_json". A problem starting with
+    "low_confidence" means the answer is usable but a larger model may do better: the router
+    escalates while the latency budget allows, and falls back to that answer if it doesn't.
+
+    A model other than the last is skipped when
+    - fewer than `min_success_rate` of its recent answers passed validation; one in
+      `probe_every` calls still goes to it so that it can recover,
+    - its recent p90 latency is longer than what's left of the budget, or
+    - none of its concurrency slots frees up within the budget.
+    The last model is always tried if there is no usable answer yet, as the call has no other
+    way to succeed; otherwise it's only tried within the budget.
+
+    Args:
+        name (str): Name of the routed call in metrics and logs.
+        routes (list[ModelRoute]): Models, smallest first.
+        budget (float): Seconds one routed call should take, including waits for slots.
+        min_samples (int): Calls a model needs before its stats are used to skip it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        routes: list[ModelRoute],
+        complete: Callable,
+        budget: float = 10,
+        min_success_rate: float = 0.5,
+        min_samples: int = 20,
+        probe_every: int = 10,
+    ):
+        self.name = name
+        self.routes = routes
+        self.complete = complete
+        self.budget = budget
+        self.min_success_rate = min_success_rate
+        self.min_samples = min_samples
+        self.probe_every = probe_every
+
+    @classmethod
+    def from_spec(cls, name: str, spec: str, complete: Callable, processes: int = 1, **kwargs) -> "LLMRouter":
+        routes = []
+        for entry in spec.split(","):
+            model, _, max_concurrency = entry.strip().partition(":")
+            max_concurrency = int(max_concurrency) if max_concurrency else 8
+            routes.append(ModelRoute(model, max(1, max_concurrency // processes)))
+        return cls(name, routes, complete, **kwargs)
+
+    def stats(self) -> dict:
+        return {route.model: route.stats() for route in self.routes}
+
+    def _skip_reason(self, route: ModelRoute, remaining: float) -> Optional[str]:
+        stats = route.stats()
+        if stats["samples"] < self.min_samples:
+            return None
+        if stats["success_rate"] < self.min_success_rate and route.next_call() % self.probe_every != 0:
+            return "skipped_unreliable"
+        if stats["p90_seconds"] > remaining:
+            return "skipped_slow"
+        return None
+
+    def _attempt(self, route: ModelRoute, messages: list, validate: Callable, kwargs: dict) -> Tuple[object, Optional[str]]:
+        start = time.perf_counter()
+        try:
+            response = self.complete(route.model, messages, **kwargs)
+        except Exception as e:
+            route.record(False, time.perf_counter() - start)
+            result = "unavailable" if isinstance(e, DependencyUnavailable) else "error"
+            llm_route_calls.inc(route=self.name, model=route.model, result=result)
+            raise
+        seconds = time.perf_counter() - start
+        llm_route_seconds.observe(seconds, route=self.name, model=route.model)
+        record_llm_usage(route.model, response.usage)
+
+        value, problem = validate(response.choices[0].message.content)
+        route.record(problem is None, seconds)
+        llm_route_calls.inc(route=self.name, model=route.model, result=problem or "accepted")
+        return value, problem
+
+    def route(self, messages: list, validate: Callable[[str], Tuple[object, Optional[str]]], **kwargs):
+        """
+        The first answer to `messages` that `validate` accepts. A model that fails is treated like
+        one that gave an invalid answer. Raises the last model's error if it fails and there's no
+        low confidence answer to fall back to, and RouteRejected if no model gave a usable answer.
+        """
+        deadline = time.monotonic() + self.budget
+        fallback = None
+        problem = None
+        for i, route in enumerate(self.routes):
+            last = i == len(self.routes) - 1
+            remaining = deadline - time.monotonic()
+            if not last:
+                skip = "skipped_budget" if remaining <= 0 else self._skip_reason(route, remaining)
+                if skip is None and not route.slots.acquire(timeout=remaining):
+                    skip = "skipped_busy"
+                if skip is not None:
+                    llm_route_calls.inc(route=self.name, model=route.model, result=skip)
+                    continue
+            elif fallback is not None:
+                # a usable answer is in hand, so the last model only gets what's left of the budget
+                if remaining <= 0 or not route.slots.acquire(timeout=remaining):
+                    llm_route_calls.inc(route=self.name, model=route.model, result="skipped_budget")
+                    break
+            else:
+                route.slots.acquire()
+
+            try:
+                value, problem = self._attempt(route, messages, validate, kwargs)
+            except Exception as e:
+                # e.g. Groq unreachable, a 400 for JSON it couldn't produce, or a retired model
+                if last:
+                    if fallback is not None:
+                        log(f"{route.model} failed for {self.name}, using the low confidence answer: {e}")
+                        return fallback
+                    raise
+                log(f"{route.model} failed for {self.name}, escalating: {e}")
+                continue
+            finally:
+                route.slots.release()
+
+            if problem is None:
+                return value
+            if problem.startswith("low_confidence"):
+                fallback = value
+            log(f"{route.model} answer to {self.name} not accepted ({problem}).")
+
+        if fallback is not None:
+            return fallback
+        raise RouteRejected(f"No model gave a valid answer to {self.name}: {problem}")
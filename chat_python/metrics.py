@@ -0,0 +1,207 @@
+"""
+In-process metrics rendered in the Prometheus text format, and per-request trace IDs for log lines.
+
+Every stage of a chat turn and of a payment lookup is timed into `stage_seconds`, so a slow
+reply can be attributed to the GAME call, requirement extraction, an explorer request, a
+block lookup or decoding. The metrics are exposed on the API's /metrics endpoint.
+"""
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# trace ID of the request being handled; context variables follow asyncio.to_thread and the
+# thread pool FastAPI runs sync endpoints in, and are copied into explorer lookups explicitly
+trace_id = contextvars.ContextVar("trace_id", default="-")
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def log(message: str):
+    """Print a log line tagged with the current trace ID."""
+    print(f"[trace={trace_id.get()}] {message}")
+
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = default_buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> (bucket counts, sum, count)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the time spent in the block, whether or not it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{format_labels(self.labels, key, le)} {bucket_count}")
+                inf = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, inf)} {count}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {total}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, key)} {count}")
+        return lines
+
+
+registry = []
+
+
+def register(metric):
+    registry.append(metric)
+    return metric
+
+
+def render() -> str:
+    return "\n".join(line for metric in registry for line in metric.render()) + "\n"
+
+
+request_seconds = register(Histogram(
+    "chat_request_seconds", "Time to handle an API request.", ("endpoint",)
+))
+stage_seconds = register(Histogram(
+    "chat_stage_seconds",
+    "Time spent in each stage of a chat turn or payment lookup: chat_next, extract_requirements, "
+    "summarize_history, transaction_lookup, explorer_request, block_lookup, decode_payment, receipt_batch.",
+    ("stage",),
+))
+explorer_lookups = register(Counter(
+    "explorer_lookups_total",
+    "Transaction lookups per network by result: found, not_found or error.",
+    ("network", "result"),
+))
+cache_lookups = register(Counter(
+    "cache_lookups_total",
+    "Lookups in the payment index, the transaction cache and the block timestamp cache by result: hit or miss.",
+    ("cache", "result"),
+))
+rate_limiter_queue_depth = register(Gauge(
+    "rate_limiter_queue_depth", "Requests waiting for a rate limiter token, per API key.", ("limiter",)
+))
+rate_limited_responses = register(Counter(
+    "rate_limited_responses_total", "Rate-limit responses received, per API key.", ("limiter",)
+))
+dependency_calls = register(Counter(
+    "dependency_calls_total",
+    "Calls to external dependencies by result: success, failure (after retries) or rejected (circuit open).",
+    ("dependency", "result"),
+))
+dependency_retries = register(Counter(
+    "dependency_retries_total", "Retried requests to external dependencies.", ("dependency",)
+))
+hedged_requests = register(Counter(
+    "hedged_requests_total", "Second requests sent because the first one was slow.", ("dependency",)
+))
+circuit_breaker_open = register(Gauge(
+    "circuit_breaker_open", "1 while the dependency's circuit breaker is open.", ("dependency",)
+))
+extraction_queue_depth = register(Gauge(
+    "extraction_queue_depth", "Partners waiting for a background working memory extraction."
+))
+extractions_coalesced = register(Counter(
+    "extractions_coalesced_total", "Extraction requests merged into one already queued for the same partner."
+))
+prewarmed_chats = register(Counter(
+    "prewarmed_chats_total",
+    "Pre-created chats by outcome: hit (taken by a new partner), miss (none was ready) or expired.",
+    ("result",),
+))
+prewarmed_chats_ready = register(Gauge(
+    "prewarmed_chats_ready", "Pre-created chats waiting for a new partner."
+))
+prewarm_refill_seconds = register(Histogram(
+    "prewarm_refill_seconds", "Time to pre-create one chat for the pool."
+))
+llm_route_calls = register(Counter(
+    "llm_route_calls_total",
+    "Routed LLM calls per model by result: accepted, the validation problem, unavailable, error, or why the model was skipped.",
+    ("route", "model", "result"),
+))
+llm_route_seconds = register(Histogram(
+    "llm_route_seconds", "Latency of routed LLM calls per model.", ("route", "model")
+))
+llm_tokens = register(Counter(
+    "llm_tokens_total", "Tokens used by LLM calls by model and kind: prompt or completion.", ("model", "kind")
+))
+
+
+def record_llm_usage(model: str, usage):
+    """Count the tokens of an OpenAI-style completion's `usage`, if the response has one."""
+    if usage is None:
+        return
+    llm_tokens.inc(usage.prompt_tokens, model=model, kind="prompt")
+    llm_tokens.inc(usage.completion_tokens, model=model, kind="completion")
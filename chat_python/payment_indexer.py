@@ -0,0 +1,194 @@
+import sqlite3
+import threading
+from typing import Optional
+
+import requests
+
+from json_rpc import rpc_call, rpc_batch
+from metrics import log
+from rate_limiter import PRIORITY_BACKGROUND
+
+# keccak256("Transfer(address,address,uint256)")
+transfer_event_topic = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+
+class PaymentIndexer:
+    """
+    Follows new blocks on each chain by polling its JSON-RPC endpoint and records every USDC
+    `Transfer` into `wallet_address` in a local SQLite index, so that payments can be checked
+    without calling an explorer.
+
+    The last processed block of each chain is checkpointed together with the payments found in
+    it, so after a restart the indexer resumes where it stopped. On the very first run it starts
+    `start_lookback` blocks behind the head. Blocks are only indexed once they have
+    `confirmations` blocks on top of them.
+
+    Args:
+        path (str): Path of the sqlite database.
+        chains (list[dict]): One dict per chain with 'name', 'rpc_url' and 'usdc_address', and optionally
+            the 'scheduler' its RPC calls are rate limited by. Indexing runs at background priority.
+        wallet_address (str): The address receiving payments.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        chains: list[dict],
+        wallet_address: str,
+        poll_interval: float = 5,
+        confirmations: int = 2,
+        max_block_range: int = 1000,
+        start_lookback: int = 1000,
+        timeout: float = 10,
+    ):
+        self.path = path
+        self.chains = chains
+        self.wallet_address = wallet_address
+        self.poll_interval = poll_interval
+        self.confirmations = confirmations
+        self.max_block_range = max_block_range
+        self.start_lookback = start_lookback
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._thread = None
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS payments ("
+            "tx_hash TEXT NOT NULL, log_index INTEGER NOT NULL, chain TEXT NOT NULL, "
+            "sender TEXT NOT NULL, recipient TEXT NOT NULL, value REAL NOT NULL, "
+            "block_number INTEGER NOT NULL, block_timestamp INTEGER NOT NULL, "
+            "PRIMARY KEY (tx_hash, log_index))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS payments_sender ON payments (sender)")
+        conn.execute("CREATE INDEX IF NOT EXISTS payments_block_timestamp ON payments (block_timestamp)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints (chain TEXT PRIMARY KEY, last_block INTEGER NOT NULL)"
+        )
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def lookup(self, tx_hash: str) -> Optional[dict]:
+        """
+        Returns the indexed payment for the transaction, or None if it hasn't been indexed.
+        Several transfers into the wallet within one transaction are summed.
+        """
+        rows = self._conn().execute(
+            "SELECT chain, sender, recipient, value, block_number, block_timestamp FROM payments "
+            "WHERE tx_hash = ? ORDER BY log_index",
+            (tx_hash.lower(),),
+        ).fetchall()
+        if not rows:
+            return None
+        chain, sender, recipient, _, block_number, block_timestamp = rows[0]
+        return {
+            "chain": chain,
+            "sender": sender,
+            "recipient": recipient,
+            "value": sum(row[3] for row in rows),
+            "block_number": block_number,
+            "block_timestamp": block_timestamp,
+        }
+
+    def checkpoint(self, chain: str) -> Optional[int]:
+        row = self._conn().execute(
+            "SELECT last_block FROM checkpoints WHERE chain = ?", (chain,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="payment-indexer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            for chain in self.chains:
+                try:
+                    self.poll_chain(chain)
+                except Exception as e:
+                    log(f"Payment indexer error on {chain['name']}: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def _rpc(self, chain: dict, fn):
+        scheduler = chain.get("scheduler")
+        return fn() if scheduler is None else scheduler.run(fn, PRIORITY_BACKGROUND)
+
+    def poll_chain(self, chain: dict):
+        """Index all confirmed blocks of the chain since its checkpoint."""
+        head = int(self._rpc(chain, lambda: rpc_call(self.session, chain["rpc_url"], "eth_blockNumber", [], self.timeout)), 16)
+        safe_head = head - self.confirmations
+
+        last_block = self.checkpoint(chain["name"])
+        if last_block is None:
+            last_block = max(safe_head - self.start_lookback, -1)
+
+        while last_block < safe_head and not self._stop.is_set():
+            to_block = min(last_block + self.max_block_range, safe_head)
+            self.index_range(chain, last_block + 1, to_block)
+            last_block = to_block
+
+    def index_range(self, chain: dict, from_block: int, to_block: int):
+        wallet_topic = "0x" + self.wallet_address.lower()[2:].rjust(64, "0")
+        logs = self._rpc(chain, lambda: rpc_call(self.session, chain["rpc_url"], "eth_getLogs", [{
+            "fromBlock": hex(from_block),
+            "toBlock": hex(to_block),
+            "address": chain["usdc_address"],
+            "topics": [transfer_event_topic, None, wallet_topic],
+        }], self.timeout))
+
+        block_numbers = sorted({log["blockNumber"] for log in logs})
+        blocks = self._rpc(chain, lambda: rpc_batch(
+            self.session,
+            chain["rpc_url"],
+            [("eth_getBlockByNumber", [number, False]) for number in block_numbers],
+            self.timeout,
+        ))
+        timestamps = {}
+        for number, block in zip(block_numbers, blocks):
+            if isinstance(block, Exception):
+                raise block
+            timestamps[number] = int(block["timestamp"], 16)
+
+        rows = [
+            (
+                log["transactionHash"].lower(),
+                int(log["logIndex"], 16),
+                chain["name"],
+                "0x" + log["topics"][1][-40:],
+                "0x" + log["topics"][2][-40:],
+                int(log["data"], 16) * 1e-6,
+                int(log["blockNumber"], 16),
+                timestamps[log["blockNumber"]],
+            )
+            for log in logs
+            if not log.get("removed")
+        ]
+
+        conn = self._conn()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO payments VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (chain, last_block) VALUES (?, ?)",
+                (chain["name"], to_block),
+            )
+        if rows:
+            log(f"Indexed {len(rows)} payments on {chain['name']} up to block {to_block}.")
@@ -0,0 +1,154 @@
+import time
+import heapq
+import random
+import itertools
+import threading
+from typing import Callable, Optional
+
+import requests
+
+from metrics import log, rate_limiter_queue_depth, rate_limited_responses
+
+# lower values are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_BACKGROUND = 2
+
+
+class RateLimited(requests.exceptions.RequestException):
+    """
+    The API rejected a request for exceeding its rate limit, or the request couldn't be
+    scheduled in time. It's a RequestException, so callers treat it like any other failed
+    request instead of as "not found".
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RequestScheduler:
+    """
+    Token bucket for the requests made with one API key. Requests wait in a priority queue
+    until the bucket has a token, so a burst of lookups is spread out at `rate` requests per
+    second instead of being throttled by the API, and interactive lookups overtake batch and
+    background ones.
+
+    When the API answers with a rate-limit response anyway, the whole bucket pauses with
+    exponential backoff, and the request is retried.
+
+    Args:
+        name (str): Name of the bucket in metrics and logs; the API key itself isn't exposed.
+        rate (float): Sustained requests per second.
+        burst (int): Max requests sent back to back after an idle period.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int = 1, max_retries: int = 3, max_backoff: float = 30):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._backoff_streak = 0
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._waiting)
+
+    def acquire(self, priority: int = PRIORITY_INTERACTIVE, timeout: Optional[float] = None) -> bool:
+        """Wait for a token. Returns False if none was granted within `timeout` seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiting, entry)
+            rate_limiter_queue_depth.set(len(self._waiting), limiter=self.name)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    wait = None
+                    # only the request at the head of the queue may take a token
+                    if self._waiting[0] == entry:
+                        if now < self._paused_until:
+                            wait = self._paused_until - now
+                        elif self._tokens >= 1:
+                            self._tokens -= 1
+                            return True
+                        else:
+                            wait = (1 - self._tokens) / self.rate
+                    if deadline is not None:
+                        if now >= deadline:
+                            return False
+                        wait = deadline - now if wait is None else min(wait, deadline - now)
+                    self._cond.wait(wait)
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                rate_limiter_queue_depth.set(len(self._waiting), limiter=self.name)
+                self._cond.notify_all()
+
+    def backoff(self, retry_after: Optional[float] = None):
+        """Pause all requests after a rate-limit response, for longer on each consecutive one."""
+        with self._cond:
+            self._backoff_streak += 1
+            delay = retry_after
+            if delay is None:
+                delay = min(self.max_backoff, (2 ** (self._backoff_streak - 1)) / self.rate)
+                delay *= random.uniform(0.5, 1.5)
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._tokens = 0.0
+            self._cond.notify_all()
+        rate_limited_responses.inc(limiter=self.name)
+        log(f"Rate limited by {self.name}, pausing requests for {delay:.2f}s.")
+
+    def _succeeded(self):
+        with self._cond:
+            self._backoff_streak = 0
+
+    def run(self, fn: Callable, priority: int = PRIORITY_INTERACTIVE, timeout: Optional[float] = None):
+        """
+        Call `fn()` once a token is granted, and again after backing off whenever it raises
+        RateLimited. Raises RateLimited if no token is granted within `timeout` seconds
+        (per attempt) or the retries run out.
+        """
+        for attempt in range(self.max_retries + 1):
+            if not self.acquire(priority, timeout):
+                raise RateLimited(f"Timed out waiting for a {self.name} request slot.")
+            try:
+                result = fn()
+            except RateLimited as e:
+                self.backoff(e.retry_after)
+                if attempt == self.max_retries:
+                    raise
+                continue
+            self._succeeded()
+            return result
+
+
+def retry_after_seconds(response: requests.Response) -> Optional[float]:
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+schedulers = {}
+schedulers_lock = threading.Lock()
+
+
+def get_scheduler(api_key: str, name: str, rate: float, burst: int = 1) -> RequestScheduler:
+    """The scheduler of an API key; networks sharing a key share its rate limit."""
+    with schedulers_lock:
+        if api_key not in schedulers:
+            schedulers[api_key] = RequestScheduler(name, rate, burst)
+        return schedulers[api_key]
@@ -0,0 +1,257 @@
+"""
+Timeouts, retries, hedged requests and circuit breakers for the external services the chat
+API depends on (the explorers, Infura, Groq and GAME), so that one degraded dependency fails
+fast instead of tying up every worker that touches it.
+
+Each dependency is configured from the environment by its upper-cased name, e.g. for groq:
+GROQ_TIMEOUT, GROQ_RETRIES, GROQ_HEDGE_PERCENTILE, GROQ_BREAKER_FAILURES, GROQ_BREAKER_RESET
+and GROQ_MAX_WORKERS.
+"""
+import os
+import re
+import time
+import random
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Optional
+
+from metrics import log, dependency_calls, dependency_retries, hedged_requests, circuit_breaker_open
+
+
+class DependencyUnavailable(Exception):
+    """The dependency failed on every attempt, or its circuit breaker is open."""
+
+    def __init__(self, dependency: str, message: str):
+        super().__init__(message)
+        self.dependency = dependency
+
+
+class CircuitOpen(DependencyUnavailable):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures, rejecting calls for `reset_timeout`
+    seconds. After that one trial call is let through: if it succeeds the breaker closes,
+    otherwise it opens again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None and time.monotonic() - self._opened_at < self.reset_timeout
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                log(f"Circuit breaker of {self.name} closed.")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+        circuit_breaker_open.set(0, dependency=self.name)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    log(f"Circuit breaker of {self.name} opened after {self._failures} failures.")
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+            opened = self._opened_at is not None
+        circuit_breaker_open.set(int(opened), dependency=self.name)
+
+
+class Dependency:
+    """
+    Calls to one external dependency.
+
+    `call(fn)` calls `fn(timeout)`; `fn` should apply the timeout to its request. Failures that
+    `retry_on` accepts as transient are retried with jittered exponential backoff and count
+    towards the circuit breaker; any other exception is raised right away.
+
+    Args:
+        timeout (float): Per-request timeout in seconds.
+        retries (int): Retries after the first attempt. Only use for idempotent requests.
+        hedge_percentile (float): If set, a second identical request is sent when the first
+            one takes longer than this percentile of recent latencies; the first response wins.
+            Only use for idempotent requests.
+        enforce_timeout (bool): Stop waiting for `fn` after the timeout even if it ignores it,
+            e.g. for clients that don't take a timeout. The timeout starts once `fn` is running,
+            not while it waits for a thread of the pool.
+        max_workers (int): Size of the thread pool that hedged requests and requests with
+            `enforce_timeout` run on. Each dependency has its own, so that calls nested in a
+            call to another dependency can't starve it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float = 10,
+        retries: int = 2,
+        hedge_percentile: Optional[float] = None,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        retry_on: Callable[[Exception], bool] = lambda e: False,
+        enforce_timeout: bool = False,
+        backoff: float = 0.2,
+        max_workers: int = 32,
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.hedge_percentile = hedge_percentile
+        self.retry_on = retry_on
+        self.enforce_timeout = enforce_timeout
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self._latencies = deque(maxlen=200)
+        self._latencies_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+    @classmethod
+    def from_env(cls, name: str, **defaults) -> "Dependency":
+        # e.g. GROQ_LLAMA_3_1_8B_INSTANT for groq-llama-3.1-8b-instant
+        prefix = re.sub(r"[^A-Z0-9]", "_", name.upper())
+        config = dict(defaults)
+        for key, env, parse in [
+            ("timeout", "TIMEOUT", float),
+            ("retries", "RETRIES", int),
+            ("hedge_percentile", "HEDGE_PERCENTILE", float),
+            ("failure_threshold", "BREAKER_FAILURES", int),
+            ("reset_timeout", "BREAKER_RESET", float),
+            ("max_workers", "MAX_WORKERS", int),
+        ]:
+            value = os.getenv(f"{prefix}_{env}")
+            if value is not None:
+                # an empty HEDGE_PERCENTILE turns hedging off
+                config[key] = None if key == "hedge_percentile" and not value else parse(value)
+        return cls(name, **config)
+
+    def available(self) -> bool:
+        return not self.breaker.is_open()
+
+    def hedge_delay(self) -> Optional[float]:
+        if self.hedge_percentile is None:
+            return None
+        with self._latencies_lock:
+            # too few samples to tell a slow request from a normal one
+            if len(self._latencies) < 20:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[min(int(len(latencies) * self.hedge_percentile / 100), len(latencies) - 1)]
+
+    def _timed(self, fn: Callable):
+        start = time.perf_counter()
+        result = fn(self.timeout)
+        with self._latencies_lock:
+            self._latencies.append(time.perf_counter() - start)
+        return result
+
+    def _submit(self, fn: Callable):
+        """Run `fn` on the pool; returns its future and an event set once it starts running."""
+        started = threading.Event()
+
+        def run():
+            started.set()
+            return self._timed(fn)
+
+        # requests run in copies of the caller's context so that their log lines carry the trace ID
+        return self._executor.submit(contextvars.copy_context().run, run), started
+
+    def _attempt(self, fn: Callable):
+        delay = self.hedge_delay()
+        if delay is None and not self.enforce_timeout:
+            return self._timed(fn)
+
+        future, started = self._submit(fn)
+        # time spent waiting for a thread is the pool's fault, not the dependency's
+        started.wait()
+        futures = [future]
+        deadline = time.monotonic() + self.timeout
+        done, _ = wait(futures, timeout=delay if delay is not None else self.timeout)
+        if not done and delay is not None:
+            hedged_requests.inc(dependency=self.name)
+            futures.append(self._submit(fn)[0])
+
+        error = None
+        pending = set(futures)
+        while pending:
+            remaining = deadline - time.monotonic() if self.enforce_timeout else None
+            if remaining is not None and remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        if error is not None and not pending:
+            raise error
+        raise TimeoutError(f"{self.name} did not respond within {self.timeout}s")
+
+    def call(self, fn: Callable):
+        if not self.breaker.allow():
+            dependency_calls.inc(dependency=self.name, result="rejected")
+            raise CircuitOpen(self.name, f"{self.name} is temporarily unavailable after repeated failures.")
+
+        for attempt in range(self.retries + 1):
+            try:
+                result = self._attempt(fn)
+            except Exception as e:
+                if not (isinstance(e, TimeoutError) or self.retry_on(e)):
+                    # not the dependency's fault, e.g. invalid input
+                    self.breaker.record_success()
+                    raise
+                if attempt < self.retries:
+                    dependency_retries.inc(dependency=self.name)
+                    time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+                    continue
+                self.breaker.record_failure()
+                dependency_calls.inc(dependency=self.name, result="failure")
+                raise DependencyUnavailable(
+                    self.name, f"{self.name} failed after {attempt + 1} attempts: {e}"
+                ) from e
+            self.breaker.record_success()
+            dependency_calls.inc(dependency=self.name, result="success")
+            return result
+
+
+dependencies = {}
+dependencies_lock = threading.Lock()
+
+
+def get_dependency(name: str, **defaults) -> Dependency:
+    """The dependency with this name, configured from the environment on first use."""
+    with dependencies_lock:
+        if name not in dependencies:
+            dependencies[name] = Dependency.from_env(name, **defaults)
+        return dependencies[name]
+
+
+def is_transient_request_error(e: Exception) -> bool:
+    """Connection errors, timeouts and server errors of `requests` calls are worth retrying."""
+    import requests
+
+    if isinstance(e, requests.exceptions.HTTPError):
+        return e.response is not None and e.response.status_code >= 500
+    return isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
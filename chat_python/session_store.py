@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+class SessionStore:
+    """
+    Key/value store for per-partner conversation state.
+
+    Values are plain JSON-serializable dicts so that every backend can persist them.
+    """
+
+    def get(self, key: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: dict):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+
+class MemorySessionStore(SessionStore):
+    """
+    In-process store with LRU eviction once more than `max_entries` sessions are held,
+    and TTL eviction of sessions that have been idle for more than `ttl` seconds.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 24 * 60 * 60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, last_access = entry
+            now = time.monotonic()
+            if now - last_access > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries[key] = (value, now)
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: dict):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+        # entries are kept in access order, so idle ones sit at the front
+        now = time.monotonic()
+        while self._entries:
+            key, (_, last_access) = next(iter(self._entries.items()))
+            if now - last_access <= self.ttl:
+                break
+            del self._entries[key]
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite-backed store in WAL mode, so sessions survive restarts.
+
+    Reads go through an in-process `MemorySessionStore` cache of hot sessions, and sessions
+    idle for more than `ttl` seconds are purged from the database.
+
+    When several processes share the database, set `validate_cache` so that a cached session
+    is only used if its row has not been rewritten by another process since.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = 24 * 60 * 60,
+        cache_size: int = 1000,
+        purge_interval: float = 60,
+        validate_cache: bool = False,
+    ):
+        self.path = path
+        self.validate_cache = validate_cache
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.cache = MemorySessionStore(max_entries=cache_size, ttl=ttl)
+        self._local = threading.local()
+        self._last_purge = 0.0
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite connections can't be shared between threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[dict]:
+        cached = self.cache.get(key)
+        if cached is not None:
+            if not self.validate_cache:
+                return cached["value"]
+            # another process may have written this session since it was cached
+            row = self._conn().execute(
+                "SELECT updated_at FROM sessions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and row[0] == cached["updated_at"]:
+                return cached["value"]
+
+        row = self._conn().execute(
+            "SELECT value, updated_at FROM sessions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            self.cache.delete(key)
+            return None
+
+        value = json.loads(row[0])
+        self.cache.set(key, {"value": value, "updated_at": row[1]})
+        return value
+
+    def set(self, key: str, value: dict):
+        updated_at = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (key, value, updated_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), updated_at),
+        )
+        conn.commit()
+        self.cache.set(key, {"value": value, "updated_at": updated_at})
+        self._maybe_purge()
+
+    def delete(self, key: str):
+        conn = self._conn()
+        conn.execute("DELETE FROM sessions WHERE key = ?", (key,))
+        conn.commit()
+        self.cache.delete(key)
+
+    def purge_expired(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+        conn.commit()
+
+    def _maybe_purge(self):
+        now = time.monotonic()
+        if now - self._last_purge > self.purge_interval:
+            self._last_purge = now
+            self.purge_expired()
+
+
+def create_session_store() -> SessionStore:
+    """
+    Build the session store configured by the environment.
+
+    SESSION_STORE: 'memory' (default) or 'sqlite'.
+    SESSION_DB_PATH: path of the sqlite database.
+    SESSION_TTL: seconds a session may stay idle before it is evicted.
+    SESSION_MAX_ENTRIES: max sessions kept in memory (the cache size for 'sqlite').
+    SESSION_CACHE_VALIDATE: '1' when the sqlite database is shared by several processes.
+    """
+    backend = os.getenv("SESSION_STORE", "memory")
+    ttl = float(os.getenv("SESSION_TTL", 24 * 60 * 60))
+    max_entries = int(os.getenv("SESSION_MAX_ENTRIES", 10000))
+
+    if backend == "memory":
+        return MemorySessionStore(max_entries=max_entries, ttl=ttl)
+    if backend == "sqlite":
+        path = os.getenv("SESSION_DB_PATH", "sessions.db")
+        validate_cache = os.getenv("SESSION_CACHE_VALIDATE", "0") == "1"
+        return SQLiteSessionStore(path, ttl=ttl, cache_size=max_entries, validate_cache=validate_cache)
+    raise ValueError(f"Unknown SESSION_STORE: {backend}")
@@ -1,18 +1,27 @@
 import sys
 import os
-from typing import Tuple
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from typing import Tuple, Optional
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
+import re
 import json
 import requests
-from openai import OpenAI
-from web3 import Web3
 from dotenv import load_dotenv
 load_dotenv()
 
-from game_sdk.game.chat_agent import ChatAgent, Chat
 from game_sdk.game.custom_types import Function, Argument, FunctionResultStatus
 
 import chat_python.luna_chat_prompt as luna_chat_prompt
+from tx_cache import TransactionCache
+from payment_indexer import PaymentIndexer, transfer_event_topic
+from json_rpc import rpc_batch, JsonRpcError
+from rate_limiter import get_scheduler, RateLimited, retry_after_seconds, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from resilience import get_dependency, DependencyUnavailable, is_transient_request_error
+from llm_router import LLMRouter
+from metrics import log, stage_seconds, explorer_lookups, cache_lookups, record_llm_usage
 
 game_api_key = os.getenv("game_api_for_twitter")
 if not game_api_key:
@@ -21,7 +30,6 @@ if not game_api_key:
 groq_api_key = os.getenv("GROQ_API_KEY")
 if not groq_api_key:
     raise ValueError("GROQ_API not set")
-groq_client = OpenAI(api_key=groq_api_key, base_url="https://api.groq.com/openai/v1")
 
 ethscan_api_key = os.getenv("ETHSCAN_API_KEY")
 if not ethscan_api_key:
@@ -39,8 +47,6 @@ infura_key = os.getenv("INFURA_KEY")
 if not infura_key:
     raise ValueError("INFURA_KEY not set")
 
-usdc_address = "0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48"
-usdc_address = Web3.to_checksum_address(usdc_address)
 usdc_abi = [{
     "inputs": [
         {"internalType": "address", "name": "recipient", "type": "address"},
@@ -51,14 +57,65 @@ usdc_abi = [{
     "stateMutability": "nonpayable",
     "type": "function"
 }]
-w3 = Web3(Web3.HTTPProvider(f"https://mainnet.infura.io/v3/{infura_key}"))
-usdc_contract = w3.eth.contract(address=usdc_address, abi=usdc_abi)
 
 
 luna_wallet_address = "0x140591903f35375AA78B01272882C2De3AeFE21c"
 
-def parse_requiremnts(msgs: list[str]) -> dict:
-    system_prompt = """
+# number of processes serving the API, e.g. the workers of cluster.py; rate and concurrency
+# limits below are per process, so each one gets an equal share of them
+process_count = max(1, int(os.getenv("CLUSTER_WORKER_COUNT", 1)))
+
+# endpoints can be pointed at local stand-ins, e.g. the stub servers in bench/stubs.py
+groq_base_url = os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+game_api_base_url = os.getenv("GAME_API_BASE_URL")
+
+# model used to fold old turns of long conversations into a summary
+summary_model = os.getenv("SUMMARY_MODEL", "llama-3.1-8b-instant")
+# requirement extraction tries these models smallest first, as model:max concurrent calls, and
+# escalates when an answer fails check_requirements; larger models are only waited for past
+# the latency budget (seconds) when no smaller one gave a usable answer, see llm_router.py
+extraction_router = LLMRouter.from_spec(
+    "extract_requirements",
+    os.getenv("EXTRACTION_MODELS", "llama-3.1-8b-instant:16,llama-3.3-70b-versatile:4"),
+    complete=lambda model, messages, **kwargs: groq_completion(
+        f"groq-{model}", hedge=False, model=model, messages=messages, **kwargs
+    ),
+    budget=float(os.getenv("EXTRACTION_LATENCY_BUDGET", 10)),
+    processes=process_count,
+)
+
+# clients below are created on first use (see warm_up), so that importing this module is fast
+groq_client = None
+twitter_chat_agent = None
+transaction_cache = None
+payment_networks = None
+payment_indexer = None
+lazy_init_lock = threading.RLock()
+
+# default per-request timeout in seconds for the blockchain explorer APIs and Infura; each one
+# can be overridden along with its retries, hedging and circuit breaker, see resilience.py
+explorer_timeout = float(os.getenv("EXPLORER_TIMEOUT", 10))
+# time budget of all explorer lookups of one check_payment call, including retries
+payment_lookup_timeout = float(os.getenv("PAYMENT_LOOKUP_TIMEOUT", 3 * explorer_timeout))
+# max keep-alive connections per host for each network's HTTP session
+explorer_pool_size = int(os.getenv("EXPLORER_POOL_SIZE", 10))
+# networks are queried concurrently on this pool
+explorer_executor = ThreadPoolExecutor(max_workers=int(os.getenv("EXPLORER_MAX_WORKERS", 16)), thread_name_prefix="explorer")
+# sustained requests per second per explorer API key and per JSON-RPC provider key; requests
+# beyond that queue up instead of being throttled by the API
+explorer_rate_limit = float(os.getenv("EXPLORER_RATE_LIMIT", 5)) / process_count
+rpc_rate_limit = float(os.getenv("RPC_RATE_LIMIT", 10)) / process_count
+# max calls per JSON-RPC batch request; larger batches are split, as providers cap their size
+rpc_batch_size = int(os.getenv("RPC_BATCH_SIZE", 50))
+# 'receipt' reads payments from the USDC Transfer logs of the transaction receipt,
+# 'calldata' decodes the input of a direct transfer() call to the USDC contract
+payment_verify_mode = os.getenv("PAYMENT_VERIFY_MODE", "receipt")
+# (explorer, block number) -> block timestamp, least recently used blocks are dropped first
+block_timestamps = OrderedDict()
+block_timestamps_lock = threading.Lock()
+block_timestamps_max_size = 4096
+
+requirements_prompt = """
     You are a helpful assistant that parses the details of the user's requirements from the conversation history.
     Given a conversation between a user and an agent, you will need to extract the details of the user's requirements.
     The details you need to extract are:
@@ -88,6 +145,15 @@ def parse_requiremnts(msgs: list[str]) -> dict:
 
     Only return the json object. Do not include any other text.
     """
+
+incremental_requirements_prompt = requirements_prompt + """
+    You are given the requirements extracted earlier in the conversation under "PREVIOUS REQUIREMENTS",
+    followed only by the newest part of the conversation.
+    Update the previous requirements with any new or changed details from the newest part of the conversation,
+    keep the previous value of every field that the newest part does not mention, and return the merged json object.
+    """
+
+def format_conversation(msgs: list[str]) -> str:
     i = 0
     convo_str = ""
     for c in msgs:
@@ -96,16 +162,211 @@ def parse_requiremnts(msgs: list[str]) -> dict:
         else:
             convo_str += f"AGENT: {c}\n"
         i += 1
-    
+    return convo_str
+
+def parse_requiremnts(msgs: list[str], working_memory: dict = None, summary: str = None) -> dict:
+    """
+    Extract the user's requirements from the conversation.
+
+    Args:
+        msgs (list[str]): Alternating user and agent messages, starting with a user message.
+        working_memory (dict): Requirements extracted from the earlier part of the conversation.
+            If given, `msgs` only needs to hold the turns since that extraction and the model
+            returns the merged requirements. If None, `msgs` should be the whole conversation.
+        summary (str): Summary of the conversation before `msgs`, if older turns were dropped.
+
+    Raises RouteRejected if no extraction model returned valid requirements.
+    """
+    convo_str = format_conversation(msgs)
+    if summary:
+        convo_str = f"SUMMARY OF THE EARLIER CONVERSATION: {summary}\n\n{convo_str}"
+
+    if working_memory is None:
+        system_prompt = requirements_prompt
+    else:
+        system_prompt = incremental_requirements_prompt
+        convo_str = f"PREVIOUS REQUIREMENTS: {json.dumps(working_memory)}\n\n{convo_str}"
+
     messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": convo_str}]
-    response = groq_client.chat.completions.create(
-        model="llama-3.3-70b-versatile",
-        messages=messages,
-        temperature=0.3,
-        response_format={"type": "json_object"}
+    with stage_seconds.time(stage="extract_requirements"):
+        return extraction_router.route(
+            messages,
+            validate=lambda content: check_requirements(content, working_memory),
+            temperature=0.3,
+            response_format={"type": "json_object"}
+        )
+
+def groq_completion(dependency: str = "groq", hedge: bool = True, **kwargs):
+    """
+    Chat completion from Groq, with the timeout, retries, hedging and circuit breaker of the given
+    dependency. Raises DependencyUnavailable if Groq can't be reached.
+
+    Args:
+        dependency (str): Name of the dependency; calls with very different latencies, e.g. to
+            models of different size, should each have their own, so that hedging compares a
+            call to others like it and one failing model doesn't open the breaker of the others.
+        hedge (bool): Hedge slow calls. Off for calls whose concurrency is limited by the caller,
+            as a hedged request would go past the limit.
+    """
+    groq = get_dependency(
+        dependency, timeout=30, retries=2, hedge_percentile=95 if hedge else None, retry_on=is_transient_llm_error
     )
+    return groq.call(lambda timeout: get_groq_client().chat.completions.create(timeout=timeout, **kwargs))
+
+def is_transient_llm_error(e: Exception) -> bool:
+    from openai import APIConnectionError, APIStatusError
+
+    # APITimeoutError is an APIConnectionError
+    if isinstance(e, APIConnectionError):
+        return True
+    return isinstance(e, APIStatusError) and (e.status_code in (408, 409, 429) or e.status_code >= 500)
+
+requirement_fields = ["name", "target", "idea", "edge", "references", "stage", "services", "price", "paid"]
+
+# fields that can only be understood from the free text of the conversation
+llm_requirement_fields = ["name", "target", "idea", "edge", "stage"]
+
+def check_requirements(content: str, previous: dict = None) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Parse an extraction model's answer and check it against the requirements schema.
+    Returns the requirements and None if they can be used, or what's wrong with them.
+
+    Args:
+        previous (dict): Requirements the model was asked to update. An answer that drops one
+            of their fields is usable, but flagged as low confidence.
+    """
+    try:
+        requirements = json.loads(content)
+    except (TypeError, ValueError):
+        return None, "invalid_json"
+    if not isinstance(requirements, dict):
+        return None, "invalid_json"
+    if any(field not in requirements for field in requirement_fields):
+        return None, "missing_field"
+
+    def is_text(value):
+        return value is None or isinstance(value, str)
+
+    def is_text_list(value):
+        return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+    price = requirements["price"]
+    if not (
+        all(is_text(requirements[field]) for field in llm_requirement_fields)
+        and (is_text(requirements["references"]) or is_text_list(requirements["references"]))
+        and (requirements["services"] is None or is_text_list(requirements["services"]))
+        and (price is None or isinstance(price, (int, float, str)) and not isinstance(price, bool))
+        and requirements["paid"] in (None, True, False, "true", "false", "None")
+    ):
+        return None, "wrong_type"
+
+    if previous and any(
+        previous.get(field) not in (None, "", "None", [])
+        and requirements[field] in (None, "", "None", [])
+        for field in requirement_fields
+    ):
+        return requirements, "low_confidence_dropped_field"
+    return requirements, None
+
+service_names = [
+    "token narrative & GTM strategy",
+    "avatar design",
+    "meme images",
+    "music generation",
+    "launch video",
+    "on-chain minting",
+]
+service_patterns = {service: re.compile(re.escape(service), re.IGNORECASE) for service in service_names}
+x_handle_pattern = re.compile(r"(?<![\w@])@(\w{1,15})\b")
+
+def requirements_from_text(msgs: list[str]) -> dict:
+    """
+    Match the requested `services` and the X handles in `references` in the user's messages.
+    Only the fields that were found are returned.
+
+    Args:
+        msgs (list[str]): Alternating user and agent messages, starting with a user message.
+    """
+    fields = {}
+    user_msgs = msgs[::2]
+
+    services = [service for service in service_names if any(service_patterns[service].search(m) for m in user_msgs)]
+    if services:
+        fields["services"] = services
+
+    handles = [f"@{handle}" for m in user_msgs for handle in x_handle_pattern.findall(m)]
+    if handles:
+        fields["references"] = list(dict.fromkeys(handles))
+
+    return fields
+
+# words that carry no requirement once the services and handles are matched
+filler_words = {
+    "a", "an", "and", "also", "the", "i", "we", "want", "wants", "would", "like", "need", "add",
+    "please", "pls", "plus", "with", "too", "yes", "yeah", "ok", "okay", "sure", "thanks", "thank",
+    "you", "me", "my", "some", "of", "for", "to", "it", "that", "sounds", "good", "great", "cool",
+}
+word_pattern = re.compile(r"[a-z0-9']+")
+
+def needs_llm_extraction(msgs: list[str]) -> bool:
+    """
+    Whether the user's messages say more than `requirements_from_text` can match, e.g. a new
+    name for the token, so that only the extraction model can pick it up.
+
+    Args:
+        msgs (list[str]): Alternating user and agent messages, starting with a user message.
+    """
+    for m in msgs[::2]:
+        text = x_handle_pattern.sub(" ", m)
+        for pattern in service_patterns.values():
+            text = pattern.sub(" ", text)
+        if any(word not in filler_words for word in word_pattern.findall(text.lower())):
+            return True
+    return False
+
+def requirements_from_function_result(fn_name: str, fn_info: dict) -> dict:
+    """
+    Take `price` and `services` from a determine_price result and `paid` from a check_payment result.
+    Only the fields that were found are returned.
+    """
+    fields = {}
+    if not fn_info:
+        return fields
+    if fn_name == "determine_price" and "price" in fn_info:
+        fields["price"] = fn_info["price"]
+        fields["services"] = fn_info["services"]
+    if fn_name == "check_payment" and "paid" in fn_info:
+        fields["paid"] = "true" if fn_info["paid"] else "false"
+    return fields
+
+summary_prompt = """
+    You are a helpful assistant that keeps a running summary of a conversation between a user and an agent.
+    You are given the current summary (which can be empty) followed by the next part of the conversation.
+    Return an updated summary that keeps every detail the user shared about their token and their requirements
+    (name, target, idea, edge, references, stage, requested services, price and payment), and drops small talk.
+    Keep the summary short. Only return the summary. Do not include any other text.
+    """
 
-    return json.loads(response.choices[0].message.content)
+def summarize_conversation(summary: str, msgs: list[str]) -> str:
+    """
+    Fold messages that are dropped from the chat history into the running summary of the conversation.
+
+    Args:
+        summary (str): The summary so far.
+        msgs (list[str]): Alternating user and agent messages, starting with a user message.
+    """
+    messages = [
+        {"role": "system", "content": summary_prompt},
+        {"role": "user", "content": f"CURRENT SUMMARY: {summary}\n\n{format_conversation(msgs)}"},
+    ]
+    with stage_seconds.time(stage="summarize_history"):
+        response = groq_completion(
+            model=summary_model,
+            messages=messages,
+            temperature=0.3,
+        )
+    record_llm_usage(summary_model, response.usage)
+    return response.choices[0].message.content.strip()
 
 def determine_price_executable(services:list[str]) -> Tuple[FunctionResultStatus, str, dict]:
     if not services:
@@ -162,46 +423,40 @@ determine_price_fn = Function(
 #         return get_transaction_value(transaction_hash, self.api_key, self.explorer, self.token)
 
 
-def get_transaction_details(transaction_hash: str):
-    """
-    Get transaction details from a blockchain explorer.
+def make_http_session(pool_size: int) -> requests.Session:
+    """HTTP session that keeps up to `pool_size` keep-alive connections to each host."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
-    Args:
-        transaction_hash (str): The transaction hash.
-        api_key (str): Your API key for the blockchain explorer.
-        explorer (str): The blockchain explorer. Only accepts 'ethscan' or 'basescan'.
-        token (str): The token symbol.
+
+def build_payment_networks() -> list[dict]:
+    """
+    Build the per-network clients used to verify payments: a pooled HTTP session for the
+    explorer API, and a Web3 provider and USDC contract decoder sharing that pool.
     """
+    from web3 import Web3
     global ethscan_api_key, basescan_api_key, base_sepoliascan_api_key, infura_key
-    
+
     usdc_address_ethscan = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
     usdc_address_basescan = "0x833589fCD6eDb6E08f4c7C32D4f71b54bdA02913"
     usdc_address_basescan_sepolia = "0x036CbD53842c5426634e7929541eC2318f3dCF7e"
 
-    usdc_abi = [{
-        "inputs": [
-            {"internalType": "address", "name": "recipient", "type": "address"},
-            {"internalType": "uint256", "name": "amount", "type": "uint256"}
-        ],
-        "name": "transfer",
-        "outputs": [{"internalType": "bool", "name": "", "type": "bool"}],
-        "stateMutability": "nonpayable",
-        "type": "function"
-    }]
-    
     networks = [
         {
             "explorer": "ethscan",
-            "api_url": "https://api.etherscan.io/api",
+            "api_url": os.getenv("ETHSCAN_API_URL", "https://api.etherscan.io/api"),
             "api_key": ethscan_api_key,
-            "w3_http_provider": f"https://mainnet.infura.io/v3/{infura_key}",
+            "w3_http_provider": os.getenv("ETH_RPC_URL", f"https://mainnet.infura.io/v3/{infura_key}"),
             "usdc_address": Web3.to_checksum_address(usdc_address_ethscan),
         },
         {
             "explorer": "basescan",
-            "api_url": "https://api.basescan.org/api",
+            "api_url": os.getenv("BASESCAN_API_URL", "https://api.basescan.org/api"),
             "api_key": basescan_api_key,
-            "w3_http_provider": f"https://base-mainnet.infura.io/v3/{infura_key}",
+            "w3_http_provider": os.getenv("BASE_RPC_URL", f"https://base-mainnet.infura.io/v3/{infura_key}"),
             "usdc_address": Web3.to_checksum_address(usdc_address_basescan),
         },
         # {
@@ -214,56 +469,343 @@ def get_transaction_details(transaction_hash: str):
     ]
 
     for network in networks:
-        try:
-            params = {
-                'module': 'proxy',
-                'action': 'eth_getTransactionByHash',
-                'txhash': transaction_hash,
-                'apikey': network['api_key'],
-            }
-            response = requests.get(network['api_url'], params=params)
-            response.raise_for_status()
-            data = response.json()
-            transaction_details = data['result']
-
-            if transaction_details:
-                if transaction_details['to'].lower() != network['usdc_address'].lower():
-                    return "Error", "Not a USDC transaction.", None
-                
-                block_number_hex = transaction_details["blockNumber"]
-                block_params = {
-                    "module": "proxy",
-                    "action": "eth_getBlockByNumber",
-                    "tag": block_number_hex,
-                    "boolean": "true",
-                    "apikey": network['api_key'],
-                }
-
-                w3 = Web3(Web3.HTTPProvider(network['w3_http_provider']))
-                usdc_contract = w3.eth.contract(address=network['usdc_address'], abi=usdc_abi)
-                decoded_input = usdc_contract.decode_function_input(transaction_details['input'])
-                usdc_value = decoded_input[1]['amount'] * 1e-6
-                receiver_address = decoded_input[1]['recipient']
-
-                block_response = requests.get(network['api_url'], params=block_params)
-                block_response.raise_for_status()
-                block_data = block_response.json()
-                timestamp_hex = block_data["result"]["timestamp"]
-                timestamp_int = int(timestamp_hex, 16)
-                transaction_time = datetime.utcfromtimestamp(timestamp_int)
-
-                print(f"Transaction found on {network['explorer']}.")
-                return usdc_value, receiver_address, transaction_time
-            
-        except requests.exceptions.RequestException as e:
-            print(f"Error during API request for {network['explorer']}: {e}")
-            pass
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            return "Error", e, None
-        
+        network["session"] = make_http_session(explorer_pool_size)
+        network["w3"] = Web3(Web3.HTTPProvider(network["w3_http_provider"], session=network["session"]))
+        network["usdc_contract"] = network["w3"].eth.contract(address=network["usdc_address"], abi=usdc_abi)
+        network["explorer_scheduler"] = get_scheduler(f"explorer:{network['api_key']}", network["explorer"], explorer_rate_limit)
+        # both networks go through the same Infura key unless their RPC URL is overridden
+        if infura_key in network["w3_http_provider"]:
+            network["rpc_scheduler"] = get_scheduler(f"rpc:{infura_key}", "infura", rpc_rate_limit)
+        else:
+            network["rpc_scheduler"] = get_scheduler(f"rpc:{network['w3_http_provider']}", f"{network['explorer']}-rpc", rpc_rate_limit)
+        network["explorer_dependency"] = get_dependency(
+            network["explorer"], timeout=explorer_timeout, retries=2, hedge_percentile=95, retry_on=is_transient_request_error
+        )
+        network["rpc_dependency"] = get_dependency(
+            network["rpc_scheduler"].name, timeout=explorer_timeout, retries=2, retry_on=is_transient_request_error
+        )
+
+    return networks
+
+
+@stage_seconds.time(stage="transaction_lookup")
+def get_transaction_details(transaction_hash: str):
+    """
+    Get transaction details from a blockchain explorer.
+
+    Returns (value, receiver_address, transaction_time), or ("Error", message, None) if the
+    transaction wasn't found or isn't a valid payment, or ("Unavailable", message, None) if it
+    wasn't found but not every network could be queried.
+
+    Args:
+        transaction_hash (str): The transaction hash.
+    """
+    details, networks = lookup_known_transaction(transaction_hash)
+    if details is not None:
+        return details
+    if not networks:
+        return "Error", "Transaction not found on Ethereum or Base networks.", None
+
+    lookup = lookup_transaction_receipt if payment_verify_mode == "receipt" else lookup_transaction
+    cancelled = threading.Event()
+    # each lookup runs in a copy of the caller's context so that its log lines carry the trace ID
+    futures = {
+        explorer_executor.submit(contextvars.copy_context().run, lookup, network, transaction_hash, cancelled): network
+        for network in networks
+    }
+    unavailable = []
+    try:
+        # the hash only exists on one chain, so the first network that finds it wins
+        for future in as_completed(futures, timeout=payment_lookup_timeout):
+            try:
+                result = future.result()
+            except (requests.exceptions.RequestException, DependencyUnavailable):
+                unavailable.append(futures[future]['explorer'])
+                continue
+            if result is not None:
+                return result
+    except FuturesTimeoutError:
+        log(f"Timed out looking up transaction {transaction_hash}.")
+        unavailable = [network['explorer'] for network in networks]
+    finally:
+        cancelled.set()
+        for future in futures:
+            future.cancel()
+
+    # a network that couldn't be queried may still have the transaction, so it isn't reported as missing
+    if unavailable:
+        return "Unavailable", f"Could not reach {', '.join(unavailable)}.", None
     return "Error", "Transaction not found on Ethereum or Base networks.", None
-    
+
+
+def lookup_known_transaction(transaction_hash: str) -> Tuple[Optional[tuple], list[dict]]:
+    """
+    Look the transaction up in the payment index and the transaction cache.
+
+    Returns (details, networks). details is the tuple `get_transaction_details` returns if the
+    transaction is already known, otherwise None; networks are the ones that still have to be
+    queried, i.e. those without a fresh "not found" entry.
+    """
+    payment_indexer = get_payment_indexer()
+    if payment_indexer is not None:
+        indexed = payment_indexer.lookup(transaction_hash)
+        cache_lookups.inc(cache="payment_index", result="miss" if indexed is None else "hit")
+        if indexed is not None:
+            log(f"Transaction found in the payment index for {indexed['chain']}.")
+            return (indexed["value"], indexed["recipient"], datetime.utcfromtimestamp(indexed["block_timestamp"])), []
+
+    networks = []
+    for network in get_payment_networks():
+        cached = get_transaction_cache().get(network["explorer"], transaction_hash)
+        cache_lookups.inc(cache="transaction_cache", result="miss" if cached is None else "hit")
+        if cached is None:
+            networks.append(network)
+        elif cached["found"]:
+            log(f"Transaction found in cache for {network['explorer']}.")
+            return (cached["value"], cached["recipient"], datetime.utcfromtimestamp(cached["block_timestamp"])), []
+    return None, networks
+
+
+def lookup_transaction(network: dict, transaction_hash: str, cancelled: threading.Event):
+    """
+    Look up a transaction on a single network.
+
+    Returns None if the transaction isn't found on the network (or the lookup was cancelled),
+    otherwise the same tuple as `get_transaction_details`.
+    """
+    try:
+        params = {
+            'module': 'proxy',
+            'action': 'eth_getTransactionByHash',
+            'txhash': transaction_hash,
+            'apikey': network['api_key'],
+        }
+        with stage_seconds.time(stage="explorer_request"):
+            data = explorer_get(network, params)
+        transaction_details = data['result']
+
+        if not transaction_details:
+            explorer_lookups.inc(network=network['explorer'], result="not_found")
+            get_transaction_cache().put_not_found(network['explorer'], transaction_hash)
+            return None
+        if cancelled.is_set():
+            return None
+        explorer_lookups.inc(network=network['explorer'], result="found")
+
+        if transaction_details['to'].lower() != network['usdc_address'].lower():
+            return "Error", "Not a USDC transaction.", None
+
+        with stage_seconds.time(stage="decode_payment"):
+            decoded_input = network['usdc_contract'].decode_function_input(transaction_details['input'])
+        usdc_value = decoded_input[1]['amount'] * 1e-6
+        receiver_address = decoded_input[1]['recipient']
+
+        timestamp_int = get_block_timestamp(network['explorer'], transaction_details["blockNumber"])
+        transaction_time = datetime.utcfromtimestamp(timestamp_int)
+        get_transaction_cache().put_found(network['explorer'], transaction_hash, usdc_value, receiver_address, timestamp_int)
+
+        log(f"Transaction found on {network['explorer']}.")
+        return usdc_value, receiver_address, transaction_time
+
+    except (requests.exceptions.RequestException, DependencyUnavailable) as e:
+        explorer_lookups.inc(network=network['explorer'], result="error")
+        log(f"Error during API request for {network['explorer']}: {e}")
+        raise
+    except Exception as e:
+        explorer_lookups.inc(network=network['explorer'], result="error")
+        log(f"An error occurred: {e}")
+        return "Error", e, None
+
+
+def lookup_transaction_receipt(network: dict, transaction_hash: str, cancelled: threading.Event):
+    """
+    Look up a transaction on a single network from its receipt, reading the amount and recipient
+    from the USDC `Transfer` event logs instead of decoding the calldata. This also covers payments
+    made through smart wallets, routers or `transferFrom`, and needs no block lookup when the
+    block timestamp is already cached.
+
+    Returns None if the transaction isn't found on the network (or the lookup was cancelled),
+    otherwise the same tuple as `get_transaction_details`.
+    """
+    try:
+        params = {
+            'module': 'proxy',
+            'action': 'eth_getTransactionReceipt',
+            'txhash': transaction_hash,
+            'apikey': network['api_key'],
+        }
+        with stage_seconds.time(stage="explorer_request"):
+            receipt = explorer_get(network, params)['result']
+
+        if not receipt:
+            explorer_lookups.inc(network=network['explorer'], result="not_found")
+            get_transaction_cache().put_not_found(network['explorer'], transaction_hash)
+            return None
+        if cancelled.is_set():
+            return None
+        explorer_lookups.inc(network=network['explorer'], result="found")
+
+        with stage_seconds.time(stage="decode_payment"):
+            error, usdc_value, receiver_address = read_receipt_payment(network, receipt)
+        if error:
+            return "Error", error, None
+
+        timestamp_int = get_block_timestamp(network['explorer'], receipt["blockNumber"])
+        transaction_time = datetime.utcfromtimestamp(timestamp_int)
+        get_transaction_cache().put_found(network['explorer'], transaction_hash, usdc_value, receiver_address, timestamp_int)
+
+        log(f"Transaction found on {network['explorer']}.")
+        return usdc_value, receiver_address, transaction_time
+
+    except (requests.exceptions.RequestException, DependencyUnavailable) as e:
+        explorer_lookups.inc(network=network['explorer'], result="error")
+        log(f"Error during API request for {network['explorer']}: {e}")
+        raise
+    except Exception as e:
+        explorer_lookups.inc(network=network['explorer'], result="error")
+        log(f"An error occurred: {e}")
+        return "Error", e, None
+
+
+def explorer_get(network: dict, params: dict, priority: int = PRIORITY_INTERACTIVE) -> dict:
+    """
+    Call the network's explorer API once its API key's scheduler grants a slot, and return the
+    JSON response. Rate-limit responses are retried after backing off, and failed requests
+    according to the network's dependency settings.
+    """
+    def request(timeout: float):
+        response = network['session'].get(network['api_url'], params=params, timeout=timeout)
+        if response.status_code == 429:
+            raise RateLimited(f"Rate limited by {network['explorer']}", retry_after_seconds(response))
+        response.raise_for_status()
+        data = response.json()
+        # the explorers answer throttled requests with HTTP 200 and the error in place of the result
+        if isinstance(data.get('result'), str) and "rate limit" in data['result'].lower():
+            raise RateLimited(f"Rate limited by {network['explorer']}: {data['result']}")
+        return data
+
+    return network['explorer_dependency'].call(
+        lambda timeout: network['explorer_scheduler'].run(lambda: request(timeout), priority, timeout=timeout)
+    )
+
+
+def read_receipt_payment(network: dict, receipt: dict) -> Tuple[Optional[str], float, str]:
+    """
+    Read the USDC payment from a transaction receipt.
+
+    Returns (error, usdc_value, receiver_address); error is None if a payment was found.
+    """
+    if receipt.get("status") == "0x0":
+        return "The transaction failed on chain.", None, None
+
+    transfers = decode_usdc_transfers(receipt["logs"], network['usdc_address'])
+    if not transfers:
+        return "Not a USDC transaction.", None, None
+
+    # a routed payment can emit several transfers, only the ones into our wallet count
+    to_luna = [t for t in transfers if t["recipient"].lower() == luna_wallet_address.lower()]
+    if to_luna:
+        return None, sum(t["value"] for t in to_luna), to_luna[0]["recipient"]
+    return None, transfers[0]["value"], transfers[0]["recipient"]
+
+
+def decode_usdc_transfers(logs: list[dict], usdc_address: str) -> list[dict]:
+    """Decode the USDC `Transfer(from, to, value)` events in a transaction receipt's logs."""
+    from web3 import Web3
+
+    transfers = []
+    for log in logs:
+        topics = log.get("topics", [])
+        if log["address"].lower() != usdc_address.lower() or len(topics) != 3 or topics[0] != transfer_event_topic:
+            continue
+        transfers.append({
+            "sender": Web3.to_checksum_address("0x" + topics[1][-40:]),
+            "recipient": Web3.to_checksum_address("0x" + topics[2][-40:]),
+            "value": int(log["data"], 16) * 1e-6,
+        })
+    return transfers
+
+
+def cached_block_timestamp(explorer: str, block_number_hex: str) -> Optional[int]:
+    key = (explorer, int(block_number_hex, 16))
+    with block_timestamps_lock:
+        timestamp = block_timestamps.get(key)
+        if timestamp is not None:
+            block_timestamps.move_to_end(key)
+        return timestamp
+
+
+def cache_block_timestamp(explorer: str, block_number_hex: str, timestamp: int):
+    with block_timestamps_lock:
+        block_timestamps[(explorer, int(block_number_hex, 16))] = timestamp
+        while len(block_timestamps) > block_timestamps_max_size:
+            block_timestamps.popitem(last=False)
+
+
+def get_block_timestamp(explorer: str, block_number_hex: str) -> int:
+    """Unix timestamp of a block. Blocks are immutable, so the result is cached."""
+    timestamp = cached_block_timestamp(explorer, block_number_hex)
+    cache_lookups.inc(cache="block_timestamp", result="miss" if timestamp is None else "hit")
+    if timestamp is not None:
+        return timestamp
+
+    network = get_payment_network(explorer)
+    block_params = {
+        "module": "proxy",
+        "action": "eth_getBlockByNumber",
+        "tag": block_number_hex,
+        "boolean": "false",
+        "apikey": network['api_key'],
+    }
+    with stage_seconds.time(stage="block_lookup"):
+        block_data = explorer_get(network, block_params)
+    timestamp = int(block_data["result"]["timestamp"], 16)
+    cache_block_timestamp(explorer, block_number_hex, timestamp)
+    return timestamp
+
+
+def get_payment_networks() -> list[dict]:
+    """The payment network clients, built on first use."""
+    global payment_networks
+    if payment_networks is None:
+        with lazy_init_lock:
+            if payment_networks is None:
+                payment_networks = build_payment_networks()
+    return payment_networks
+
+
+def get_payment_network(explorer: str) -> dict:
+    return next(network for network in get_payment_networks() if network["explorer"] == explorer)
+
+
+def get_payment_indexer() -> Optional[PaymentIndexer]:
+    """
+    Local index of USDC payments into the Luna wallet, followed in the background. It's only
+    enabled with PAYMENT_INDEXER=1; check_payment then only goes to the explorers when a
+    transaction isn't indexed yet.
+    """
+    global payment_indexer
+    if payment_indexer is None and os.getenv("PAYMENT_INDEXER", "0") == "1":
+        networks = get_payment_networks()
+        with lazy_init_lock:
+            if payment_indexer is None:
+                payment_indexer = PaymentIndexer(
+                    os.getenv("PAYMENT_INDEX_PATH", "payments.db"),
+                    [
+                        {
+                            "name": network["explorer"],
+                            "rpc_url": network["w3_http_provider"],
+                            "usdc_address": network["usdc_address"],
+                            "scheduler": network["rpc_scheduler"],
+                        }
+                        for network in networks
+                    ],
+                    luna_wallet_address,
+                    poll_interval=float(os.getenv("PAYMENT_INDEXER_POLL_INTERVAL", 5)),
+                    confirmations=int(os.getenv("PAYMENT_INDEXER_CONFIRMATIONS", 2)),
+                )
+    return payment_indexer
+
 
 def check_payment_executable(transaction_hash: str, price: int):
     global luna_wallet_address
@@ -272,9 +814,22 @@ def check_payment_executable(transaction_hash: str, price: int):
     if not price:
         return FunctionResultStatus.FAILED, "Price empty. Please input a valid price.", {"paid": False}
     
-    print(f"Checking payment for transaction hash: {transaction_hash}")
-    value, receiver_address, txn_time = get_transaction_details(transaction_hash)
+    log(f"Checking payment for transaction hash: {transaction_hash}")
+    return evaluate_payment(transaction_hash, price, get_transaction_details(transaction_hash))
+
+# who the payment being checked is for, e.g. the partner id, set by the caller of chat.next;
+# a transaction hash is only accepted for the owner it first paid for
+payment_owner = contextvars.ContextVar("payment_owner", default=None)
+
+def evaluate_payment(transaction_hash: str, price: float, transaction_details: tuple, record_use: bool = True) -> Tuple[FunctionResultStatus, str, dict]:
+    """
+    Decide whether the transaction found by `get_transaction_details` pays for the product.
+    An accepted payment is recorded as used unless `record_use` is False, e.g. for a read-only check.
+    """
+    value, receiver_address, txn_time = transaction_details
 
+    if value == "Unavailable":
+        return FunctionResultStatus.FAILED, f"Payment verification is temporarily unavailable. {receiver_address} Please tell the user that the payment can't be checked right now and ask them to send the transaction hash again in a few minutes.", {"paid": False}
     if value == "Error":
         return FunctionResultStatus.FAILED, f"Transaction not found or error. Please input a valid transaction hash. Error: {receiver_address}", {"paid": False}
     if value is None:
@@ -289,7 +844,14 @@ def check_payment_executable(transaction_hash: str, price: int):
     if value < price:
         return FunctionResultStatus.FAILED, f"The user has not paid the full amount. The user has paid {value} USDC. Please ask the user to pay {price - value} USDC.", {"paid": False, "txn_value": value, "product_price": price}
     
-    if value >= price and receiver_address == luna_wallet_address.lower() and time_diff.days == 0 and time_diff.seconds <= 60 * 10:
+    if value >= price and receiver_address.lower() == luna_wallet_address.lower() and time_diff.days == 0 and time_diff.seconds <= 60 * 10:
+        if record_use:
+            used = not get_transaction_cache().mark_used(transaction_hash, price, payment_owner.get())
+        else:
+            used = get_transaction_cache().is_used(transaction_hash, payment_owner.get())
+        if used:
+            log(f"Transaction hash {transaction_hash} was already used for another payment.")
+            return FunctionResultStatus.FAILED, "This transaction has already been used to pay for a product. Please ask the user to make a new payment and send its transaction hash.", {"paid": False, "txn_value": value, "product_price": price}
         return FunctionResultStatus.DONE, f"The user has paid {value} USDC for the product.", {"paid": True, "txn_value": value, "product_price": price}
     else:
         return FunctionResultStatus.FAILED, f"The user has not paid for the product. The amount paid is {value} USDC.", {"paid": False, "txn_value": value, "product_price": price}
@@ -304,6 +866,144 @@ check_payment_fn = Function(
     executable=check_payment_executable,
 )
 
+
+def check_payments_batch(payments: list[tuple[str, float]]) -> list[Tuple[FunctionResultStatus, str, dict]]:
+    """
+    Verify many payments at once, returning the same statuses and feedback as `check_payment_executable`.
+    This is a read-only check: accepted payments are not recorded as used.
+
+    Identical transaction hashes are looked up once, and the lookups are coalesced into one
+    JSON-RPC batch per chain, plus one batch for the blocks whose timestamps aren't cached.
+
+    Args:
+        payments (list[tuple[str, float]]): (transaction_hash, expected_price) pairs.
+    """
+    transaction_hashes = list(dict.fromkeys(tx_hash.lower() for tx_hash, price in payments if tx_hash and price))
+    details = get_transactions_details_batch(transaction_hashes)
+
+    results = []
+    for transaction_hash, price in payments:
+        if not transaction_hash:
+            results.append((FunctionResultStatus.FAILED, "Transaction hash empty. Please ask the user to provide a valid transaction hash.", {"paid": False}))
+        elif not price:
+            results.append((FunctionResultStatus.FAILED, "Price empty. Please input a valid price.", {"paid": False}))
+        else:
+            results.append(evaluate_payment(transaction_hash, price, details[transaction_hash.lower()], record_use=False))
+    return results
+
+
+def get_transactions_details_batch(transaction_hashes: list[str]) -> dict:
+    """
+    Batch version of `get_transaction_details`. Returns a dict mapping each of the transaction
+    hashes to the tuple `get_transaction_details` would return for it.
+    """
+    details = {}
+    pending = {network["explorer"]: [] for network in get_payment_networks()}
+    for transaction_hash in transaction_hashes:
+        known, networks = lookup_known_transaction(transaction_hash)
+        if known is not None:
+            details[transaction_hash] = known
+        for network in networks:
+            pending[network["explorer"]].append(transaction_hash)
+
+    futures = [
+        explorer_executor.submit(contextvars.copy_context().run, fetch_receipts_batch, network, pending[network["explorer"]])
+        for network in get_payment_networks()
+        if pending[network["explorer"]]
+    ]
+    for future in futures:
+        for transaction_hash, result in future.result().items():
+            # a hash only exists on one chain, so at most one network has a result for it other than
+            # "Unavailable", which it takes precedence over
+            if transaction_hash not in details or details[transaction_hash][0] == "Unavailable":
+                details[transaction_hash] = result
+
+    for transaction_hash in transaction_hashes:
+        details.setdefault(transaction_hash, ("Error", "Transaction not found on Ethereum or Base networks.", None))
+    return details
+
+
+@stage_seconds.time(stage="receipt_batch")
+def fetch_receipts_batch(network: dict, transaction_hashes: list[str]) -> dict:
+    """
+    Fetch the receipts of the transactions from the network's JSON-RPC endpoint in one batch.
+    Returns a dict with the `get_transaction_details` tuple of each transaction found on the network.
+    """
+    results = {}
+    try:
+        receipts = rpc_batch_request(
+            network, [("eth_getTransactionReceipt", [transaction_hash]) for transaction_hash in transaction_hashes]
+        )
+
+        block_numbers = list({
+            receipt["blockNumber"] for receipt in receipts
+            if isinstance(receipt, dict) and cached_block_timestamp(network["explorer"], receipt["blockNumber"]) is None
+        })
+        blocks = rpc_batch_request(network, [("eth_getBlockByNumber", [block_number, False]) for block_number in block_numbers])
+        failed_blocks = set()
+        for block_number, block in zip(block_numbers, blocks):
+            if isinstance(block, dict):
+                cache_block_timestamp(network["explorer"], block_number, int(block["timestamp"], 16))
+            elif isinstance(block, Exception):
+                log(f"Error fetching block {block_number} on {network['explorer']}: {block}")
+                failed_blocks.add(block_number)
+
+        for transaction_hash, receipt in zip(transaction_hashes, receipts):
+            if isinstance(receipt, Exception):
+                explorer_lookups.inc(network=network["explorer"], result="error")
+                log(f"Error fetching receipt of {transaction_hash} on {network['explorer']}: {receipt}")
+                results[transaction_hash] = ("Unavailable", f"Could not reach {network['explorer']}.", None)
+                continue
+            if receipt is None:
+                explorer_lookups.inc(network=network["explorer"], result="not_found")
+                get_transaction_cache().put_not_found(network["explorer"], transaction_hash)
+                continue
+
+            explorer_lookups.inc(network=network["explorer"], result="found")
+            with stage_seconds.time(stage="decode_payment"):
+                error, usdc_value, receiver_address = read_receipt_payment(network, receipt)
+            if error:
+                results[transaction_hash] = ("Error", error, None)
+                continue
+
+            timestamp_int = cached_block_timestamp(network["explorer"], receipt["blockNumber"])
+            if timestamp_int is None:
+                if receipt["blockNumber"] in failed_blocks:
+                    results[transaction_hash] = ("Unavailable", f"Could not reach {network['explorer']}.", None)
+                else:
+                    results[transaction_hash] = ("Error", "Block of the transaction not found.", None)
+                continue
+
+            get_transaction_cache().put_found(network["explorer"], transaction_hash, usdc_value, receiver_address, timestamp_int)
+            results[transaction_hash] = (usdc_value, receiver_address, datetime.utcfromtimestamp(timestamp_int))
+
+    except (requests.exceptions.RequestException, JsonRpcError, DependencyUnavailable) as e:
+        explorer_lookups.inc(network=network["explorer"], result="error")
+        log(f"Error during batch request for {network['explorer']}: {e}")
+        for transaction_hash in transaction_hashes:
+            results.setdefault(transaction_hash, ("Unavailable", f"Could not reach {network['explorer']}.", None))
+        return results
+
+    log(f"Found {len(results)} of {len(transaction_hashes)} transactions on {network['explorer']}.")
+    return results
+
+
+def rpc_batch_request(network: dict, calls: list[tuple[str, list]]) -> list:
+    """
+    `rpc_batch` on the network's JSON-RPC endpoint, rate limited and with the retries and circuit
+    breaker of its dependency. The calls are sent in batches of at most `rpc_batch_size`.
+    """
+    def send(chunk):
+        return network["rpc_dependency"].call(lambda timeout: network["rpc_scheduler"].run(
+            lambda: rpc_batch(network["session"], network["w3_http_provider"], chunk, timeout),
+            PRIORITY_BATCH,
+        ))
+
+    results = []
+    for start in range(0, len(calls), rpc_batch_size):
+        results += send(calls[start:start + rpc_batch_size])
+    return results
+
 chat_agent_prompt = f"""
 Your job is to gather useful information from the user regarding their requirements on a digital art.
 
@@ -324,7 +1024,54 @@ You should tell the user the price of the product after determining the price. A
 Lastly, check if the user has paid for the product. Use the check_payment function to check if the user has paid for the product.
 """
 
-twitter_chat_agent = ChatAgent(
-    api_key=game_api_key,
-    prompt=luna_chat_prompt.lunaChatPrompt,
-)
\ No newline at end of file
+def get_twitter_chat_agent():
+    """The GAME chat agent, created on first use."""
+    global twitter_chat_agent
+    if twitter_chat_agent is None:
+        with lazy_init_lock:
+            if twitter_chat_agent is None:
+                from game_sdk.game.chat_agent import ChatAgent
+                twitter_chat_agent = ChatAgent(
+                    api_key=game_api_key,
+                    prompt=luna_chat_prompt.lunaChatPrompt,
+                )
+                if game_api_base_url:
+                    twitter_chat_agent.client.base_url = game_api_base_url
+    return twitter_chat_agent
+
+def get_transaction_cache() -> TransactionCache:
+    """
+    Persistent cache of transaction lookups, opened on first use. Lookups survive restarts;
+    "not found" results are only cached for TX_NEGATIVE_TTL seconds.
+    """
+    global transaction_cache
+    if transaction_cache is None:
+        with lazy_init_lock:
+            if transaction_cache is None:
+                transaction_cache = TransactionCache(
+                    os.getenv("TX_CACHE_PATH", "transactions.db"),
+                    negative_ttl=float(os.getenv("TX_NEGATIVE_TTL", 30)),
+                )
+    return transaction_cache
+
+def get_groq_client():
+    """OpenAI-compatible client for the Groq API, created on first use."""
+    global groq_client
+    if groq_client is None:
+        with lazy_init_lock:
+            if groq_client is None:
+                from openai import OpenAI
+                # retries are done by the groq dependency, see groq_completion
+                groq_client = OpenAI(api_key=groq_api_key, base_url=groq_base_url, max_retries=0)
+    return groq_client
+
+def warm_up():
+    """
+    Create the lazily initialized clients ahead of the first request, e.g. at app startup.
+    Importing this module stays cheap; this is where web3, openai and the GAME client get loaded.
+    """
+    get_groq_client()
+    get_transaction_cache()
+    get_twitter_chat_agent()
+    get_payment_networks()
+    get_payment_indexer()
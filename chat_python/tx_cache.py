@@ -0,0 +1,100 @@
+import time
+import sqlite3
+import threading
+from typing import Optional
+
+
+class TransactionCache:
+    """
+    Persistent cache of transaction lookups, keyed by (chain, tx_hash).
+
+    A confirmed transaction never changes, so found transactions are kept indefinitely.
+    "Not found" results are only kept for `negative_ttl` seconds, since the transaction may
+    still be propagating. Hashes that have already been accepted as a payment are recorded too.
+    """
+
+    def __init__(self, path: str, negative_ttl: float = 30):
+        self.path = path
+        self.negative_ttl = negative_ttl
+        self._local = threading.local()
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS transactions ("
+            "chain TEXT NOT NULL, tx_hash TEXT NOT NULL, found INTEGER NOT NULL, "
+            "value REAL, recipient TEXT, block_timestamp INTEGER, cached_at REAL NOT NULL, "
+            "PRIMARY KEY (chain, tx_hash))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS used_payments ("
+            "tx_hash TEXT PRIMARY KEY, price REAL, used_at REAL NOT NULL, owner TEXT)"
+        )
+        # databases created before payments had an owner
+        if "owner" not in [row[1] for row in conn.execute("PRAGMA table_info(used_payments)")]:
+            conn.execute("ALTER TABLE used_payments ADD COLUMN owner TEXT")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, chain: str, tx_hash: str) -> Optional[dict]:
+        """
+        Returns None on a cache miss, {"found": False} for a fresh negative entry, or
+        {"found": True, "value", "recipient", "block_timestamp"} for a confirmed transaction.
+        """
+        row = self._conn().execute(
+            "SELECT found, value, recipient, block_timestamp, cached_at FROM transactions "
+            "WHERE chain = ? AND tx_hash = ?",
+            (chain, tx_hash.lower()),
+        ).fetchone()
+        if row is None:
+            return None
+
+        found, value, recipient, block_timestamp, cached_at = row
+        if not found:
+            if time.time() - cached_at > self.negative_ttl:
+                return None
+            return {"found": False}
+        return {"found": True, "value": value, "recipient": recipient, "block_timestamp": block_timestamp}
+
+    def put_found(self, chain: str, tx_hash: str, value: float, recipient: str, block_timestamp: int):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO transactions VALUES (?, ?, 1, ?, ?, ?, ?)",
+            (chain, tx_hash.lower(), value, recipient, block_timestamp, time.time()),
+        )
+        conn.commit()
+
+    def put_not_found(self, chain: str, tx_hash: str):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO transactions VALUES (?, ?, 0, NULL, NULL, NULL, ?)",
+            (chain, tx_hash.lower(), time.time()),
+        )
+        conn.commit()
+
+    def mark_used(self, tx_hash: str, price: float, owner: Optional[str] = None) -> bool:
+        """
+        Record that the transaction paid for a product of `owner`, e.g. a partner id. Returns False
+        if it was already recorded for someone else; checking it again for the same owner is fine.
+        """
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR IGNORE INTO used_payments (tx_hash, price, used_at, owner) VALUES (?, ?, ?, ?)",
+            (tx_hash.lower(), price, time.time(), owner),
+        )
+        conn.commit()
+        return not self.is_used(tx_hash, owner)
+
+    def is_used(self, tx_hash: str, owner: Optional[str] = None) -> bool:
+        """Whether the transaction already paid for a product of someone other than `owner`."""
+        row = self._conn().execute(
+            "SELECT owner FROM used_payments WHERE tx_hash = ?", (tx_hash.lower(),)
+        ).fetchone()
+        return row is not None and (owner is None or row[0] != owner)